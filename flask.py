@@ -6,11 +6,7 @@ def search():
     if prefix and not prefix.endswith('/'):
         prefix += '/'
 
-    folders, files, _, _, _ = list_files_in_folder(prefix)
-
-    # Filter based on query
-    folders = [f for f in folders if query in f.lower()]
-    files = [f for f in files if query in f.lower()]
+    folders, files, _, _, _ = list_files_in_folder(prefix, query)
 
     return render_template('partials/file_list.html', folders=folders, files=files, prefix=prefix)
 
@@ -188,41 +184,122 @@ def search():
 
 
 
-def list_files_in_folder(prefix):
-    folders = []
-    files = []
-    total_size = 0
-    continuation_token = None
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# The app's s3 client uses botocore's default pool of 10 connections; raise this only
+# together with the client's Config(max_pool_connections=...)
+LIST_WORKERS = 10
+LIST_SHARD_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Seconds a folder listing may be reused across requests; 0 (the default) lists on every
+# request. Changes made by other clients show up only after the listing expires.
+LISTING_CACHE_SECONDS = 0
 
-    try:
-        while True:
-            params = {
-                'Bucket': bucket_name,
-                'Prefix': prefix,
-                'Delimiter': '/'
-            }
-            if continuation_token:
-                params['ContinuationToken'] = continuation_token
+# prefix -> FolderListing, dropped by invalidate_listings() when this app writes under it
+listing_cache = {}
 
-            response = s3.list_objects_v2(**params)
 
-            if 'CommonPrefixes' in response:
-                folders.extend(cp['Prefix'] for cp in response['CommonPrefixes'])
+class PackedStrings:
+    # Sorted names in one UTF-8 bytearray plus an offsets array instead of a list of str
+    def __init__(self, strings):
+        self.blob = bytearray()
+        self.offsets = array('q', [0])
+        for string in strings:
+            self.blob += string.encode('utf-8', 'surrogatepass')
+            self.offsets.append(len(self.blob))
 
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    if obj['Key'] != prefix:
-                        files.append(obj['Key'])
-                        total_size += obj['Size']
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8', 'surrogatepass')
+
+
+class FolderListing:
+    # One folder's sorted listing with the folder prefix stripped from every name. Only
+    # cached listings are packed; a listing used for one request keeps plain lists.
+    def __init__(self, prefix, folders, objects, pack=False):
+        strings = PackedStrings if pack else list
+        self.prefix = prefix
+        self.listed_at = time.monotonic()
+        objects = sorted((o['Key'][len(prefix):], o['Size']) for o in objects if o['Key'] != prefix)
+        self.folders = strings(sorted(set(f[len(prefix):] for f in folders)))
+        self.files = strings(name for name, _ in objects)
+        self.total_size = sum(size for _, size in objects)
+
+    def folder_keys(self, query=''):
+        keys = (self.prefix + name for name in self.folders)
+        return [key for key in keys if query in key.lower()]
+
+    def file_keys(self, query=''):
+        keys = (self.prefix + name for name in self.files)
+        return [key for key in keys if query in key.lower()]
 
-            if not response.get('IsTruncated'):
-                break
-            continuation_token = response.get('NextContinuationToken')
 
+def list_folder_shard(prefix, lower, upper):
+    # Lists one (lower, upper] slice of the folder; shards split at prefix + <char>
+    folders, objects = [], []
+    params = {'Bucket': bucket_name, 'Prefix': prefix, 'Delimiter': '/'}
+    if lower:
+        params['StartAfter'] = lower
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        page_folders = [cp['Prefix'] for cp in page.get('CommonPrefixes', [])]
+        page_objects = page.get('Contents', [])
+        folders.extend(f for f in page_folders if not upper or f <= upper)
+        objects.extend(o for o in page_objects if not upper or o['Key'] <= upper)
+        if upper and (any(f > upper for f in page_folders) or any(o['Key'] > upper for o in page_objects)):
+            break
+    return folders, objects
+
+
+def list_folder(prefix, pack=False):
+    # Most folders fit in one page; only a truncated first page fans out to the shards,
+    # which resume after the last name the first page returned
+    first = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix, Delimiter='/')
+    folders = [cp['Prefix'] for cp in first.get('CommonPrefixes', [])]
+    objects = first.get('Contents', [])
+    if not first.get('IsTruncated'):
+        return FolderListing(prefix, folders, objects, pack)
+
+    start = max(folders[-1:] + [o['Key'] for o in objects[-1:]])
+    bounds = [f"{prefix}{c}" for c in LIST_SHARD_CHARS if f"{prefix}{c}" > start]
+    shards = list(zip([start] + bounds, bounds + [None]))
+
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+        for shard_folders, shard_objects in executor.map(lambda shard: list_folder_shard(prefix, *shard), shards):
+            folders.extend(shard_folders)
+            objects.extend(shard_objects)
+
+    return FolderListing(prefix, folders, objects, pack)
+
+
+def cached_listing(prefix):
+    # Page views and searches within LISTING_CACHE_SECONDS reuse one listing
+    listing = listing_cache.get(prefix)
+    if listing is None or time.monotonic() - listing.listed_at > LISTING_CACHE_SECONDS:
+        listing = list_folder(prefix, pack=True)
+        listing_cache[prefix] = listing
+    return listing
+
+
+def invalidate_listings(key):
+    # Drops the cached listings of every folder containing key, and of key's own subfolders
+    for prefix in list(listing_cache):
+        if key.startswith(prefix) or prefix.startswith(key):
+            listing_cache.pop(prefix, None)
+
+
+def list_files_in_folder(prefix, query=''):
+    try:
+        listing = cached_listing(prefix) if LISTING_CACHE_SECONDS else list_folder(prefix)
     except Exception as e:
         flash(f'Error listing files: {e}', 'danger')
+        return [], [], 0, 0, 0
 
-    return folders, files, len(folders), len(files), total_size
+    folders = listing.folder_keys(query)
+    files = listing.file_keys(query)
+    return folders, files, len(folders), len(files), listing.total_size
 
 
 
@@ -281,10 +358,7 @@ def search():
     if prefix and not prefix.endswith('/'):
         prefix += '/'
 
-    folders, files = list_files_in_folder(prefix)
-
-    folders = [f for f in folders if query in f.lower()]
-    files = [f for f in files if query in f.lower()]
+    folders, files, _, _, _ = list_files_in_folder(prefix, query)
 
     return render_template('file_list.html', folders=folders, files=files, prefix=prefix)
 
@@ -301,6 +375,7 @@ def create_folder():
     new_folder = f'{prefix}{folder_name}/'
     try:
         s3.put_object(Bucket=bucket_name, Key=new_folder)
+        invalidate_listings(new_folder)
         flash('Folder created successfully.', 'success')
     except Exception as e:
         flash(f'Error creating folder: {e}', 'danger')
@@ -315,6 +390,7 @@ def upload_file():
     file_key = f'{prefix}{file.filename}'
     try:
         s3.put_object(Bucket=bucket_name, Key=file_key, Body=file)
+        invalidate_listings(file_key)
         flash('File uploaded successfully.', 'success')
     except Exception as e:
         flash(f'Error uploading file: {e}', 'danger')
@@ -330,6 +406,7 @@ def create_file():
     file_key = f'{prefix}{file_name}'
     try:
         s3.put_object(Bucket=bucket_name, Key=file_key, Body=file_content)
+        invalidate_listings(file_key)
         flash('File created successfully.', 'success')
     except Exception as e:
         flash(f'Error creating file: {e}', 'danger')
@@ -341,6 +418,7 @@ def edit_file(key):
         new_content = request.form['file_content']
         try:
             s3.put_object(Bucket=bucket_name, Key=key, Body=new_content)
+            invalidate_listings(key)
             flash('File updated successfully.', 'success')
         except Exception as e:
             flash(f'Error updating file: {e}', 'danger')
@@ -367,6 +445,7 @@ def delete_file_or_folder(key):
         else:
             # It's a file, delete it
             s3.delete_object(Bucket=bucket_name, Key=key)
+        invalidate_listings(key)
         flash('Deleted successfully.', 'success')
     except Exception as e:
         flash(f'Error deleting: {e}', 'danger')
@@ -404,6 +483,7 @@ def generate_jibberish():
             s3.put_object(Bucket=bucket_name, Key=file_key, Body=file_content)
         except Exception as e:
             flash(f'Error creating file: {e}', 'danger')
+    invalidate_listings(prefix)
     
     flash('Random jibberish files and folders created successfully.', 'success')
     return redirect(url_for('index', prefix=prefix))
@@ -419,6 +499,7 @@ def cleanup():
         if 'Contents' in response:
             for obj in response['Contents']:
                 s3.delete_object(Bucket=bucket_name, Key=obj['Key'])
+        invalidate_listings(prefix)
         flash('Cleanup successful.', 'success')
     except Exception as e:
         flash(f'Error during cleanup: {e}', 'danger')
@@ -32,14 +32,20 @@ if key == new_key:
 import os
 import sys
 import csv
+import math
+import time
+import heapq
 import boto3
 import pymysql
 import logging
 import urllib3
 import argparse
+import threading
 import unicodedata
 from pathlib import Path
-from difflib import get_close_matches
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from difflib import SequenceMatcher
 from urllib.parse import unquote
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -61,6 +67,12 @@ SECRET_KEY = "your-s3-secret-key"
 SOURCE_DIR = "Y:/path/to/share"
 TARGET_PREFIX = "legacy/"
 
+FUZZY_CUTOFF = 0.85
+FUZZY_SHORTLIST = 50
+STREAM_FETCH_SIZE = 10000
+COMMIT_EVERY_ROWS = 1000
+COMMIT_EVERY_SECONDS = 0
+
 # === LOGGING ===
 logging.basicConfig(
     level=logging.INFO,
@@ -117,19 +129,137 @@ def upload_file(local_path, s3_key):
         logger.error(f"Error uploading {local_path}: {e}")
         return None
 
-def get_db_urls():
-    with db.cursor() as cursor:
-        cursor.execute(f"SELECT id, url FROM {TABLE_NAME}")
-        return cursor.fetchall()
+# Yields the rows of `sql`. With stream, a separate connection reads them through a
+# server-side cursor a fetch at a time, so the table is never held as one list and `db`
+# stays free for the updates.
+def fetch_rows(sql, stream=False, fetch_size=STREAM_FETCH_SIZE):
+    if not stream:
+        with db.cursor() as cursor:
+            cursor.execute(sql)
+            yield from cursor.fetchall()
+        return
+    read_db = pymysql.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASS,
+        database=DB_NAME,
+        cursorclass=pymysql.cursors.SSDictCursor
+    )
+    try:
+        with read_db.cursor() as cursor:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+    finally:
+        read_db.close()
+
+def get_db_urls(stream=False, fetch_size=STREAM_FETCH_SIZE):
+    return fetch_rows(f"SELECT id, url FROM {TABLE_NAME}", stream, fetch_size)
+
+# Commits whenever `every_rows` updates or `every_seconds` have accumulated (0 disables
+# either limit) and logs each chunk's size and timing.
+class ChunkedCommitter:
+    def __init__(self, conn, label, every_rows=COMMIT_EVERY_ROWS, every_seconds=COMMIT_EVERY_SECONDS):
+        self.conn = conn
+        self.label = label
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.pending = 0
+        self.committed = 0
+        self.chunks = 0
+        self.chunk_start = time.monotonic()
+
+    def tick(self, rows=1):
+        self.pending += rows
+        if self.every_rows and self.pending >= self.every_rows:
+            self.commit()
+        elif self.every_seconds and time.monotonic() - self.chunk_start >= self.every_seconds:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        commit_start = time.monotonic()
+        self.conn.commit()
+        now = time.monotonic()
+        elapsed = now - self.chunk_start
+        self.chunks += 1
+        self.committed += self.pending
+        logger.info(
+            f"[COMMIT] {self.label} chunk {self.chunks}: {self.pending} rows in {elapsed:.2f}s "
+            f"({self.pending / elapsed if elapsed else 0:.0f} rows/s, commit {now - commit_start:.2f}s)"
+        )
+        self.pending = 0
+        self.chunk_start = now
+
+    def finish(self):
+        self.commit()
+        logger.info(f"[COMMIT] {self.label}: {self.committed} rows committed in {self.chunks} chunks")
+
+# === FUZZY INDEX ===
+# Trigram postings over the normalized names, ordered by name length so a lookup only
+# counts shared grams inside the length band where the ratio can reach the cutoff.
+# The names sharing the most grams are then scored exactly like get_close_matches().
+class FuzzyIndex:
+    def __init__(self, names, gram_size=3, shortlist=FUZZY_SHORTLIST):
+        self.gram_size = gram_size
+        self.shortlist = shortlist
+        self.names = sorted({name for name in names if name}, key=len)
+        self.lengths = [len(name) for name in self.names]
+        self.postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in self.grams(name):
+                self.postings[gram].append(i)
+        logger.info(f"Built fuzzy index over {len(self.names)} names ({len(self.postings)} trigrams)")
+
+    def grams(self, name):
+        pad = " " * (self.gram_size - 1)
+        padded = f"{pad}{name}{pad}"
+        return {padded[i:i + self.gram_size] for i in range(len(padded) - self.gram_size + 1)}
+
+    def lookup(self, name, cutoff=FUZZY_CUTOFF):
+        if not name or not self.names:
+            return None
 
-def find_best_match(filename, candidates):
-    names = [normalize_filename(c['url'].split("/")[-1]) for c in candidates]
-    match = get_close_matches(normalize_filename(filename), names, n=1, cutoff=0.85)
-    if match:
-        for c in candidates:
-            if normalize_filename(c['url'].split("/")[-1]) == match[0]:
-                return c
-    return None
+        lo = bisect_left(self.lengths, math.ceil(len(name) * cutoff / (2 - cutoff) - 1e-9))
+        hi = bisect_right(self.lengths, math.floor(len(name) * (2 - cutoff) / cutoff + 1e-9))
+        shared = defaultdict(int)
+        for gram in self.grams(name):
+            posting = self.postings.get(gram)
+            if posting:
+                for i in posting[bisect_left(posting, lo):bisect_left(posting, hi)]:
+                    shared[i] += 1
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(name)
+        best = None
+        for i in heapq.nlargest(self.shortlist, shared, key=shared.get):
+            matcher.set_seq1(self.names[i])
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, self.names[i]) > best):
+                    best = (score, self.names[i])
+        return best[1] if best else None
+
+# Normalized filename -> DB row, built once per run so exact and fuzzy matches are dict
+# lookups. When several rows share a name the first one is used, as before.
+def index_db_rows(rows):
+    rows_by_name = {}
+    duplicates = set()
+    for row in rows:
+        name = normalize_filename(row["url"].split("/")[-1]) if row["url"] else None
+        if name and rows_by_name.setdefault(name, row) is not row:
+            duplicates.add(name)
+    if duplicates:
+        logger.warning(f"{len(duplicates)} filenames map to more than one DB row, the first row is used")
+    return rows_by_name
+
+def find_best_match(filename, rows_by_name, fuzzy_index):
+    match = fuzzy_index.lookup(normalize_filename(filename))
+    return rows_by_name.get(match) if match else None
 
 # === SYNC ===
 def sync(args):
@@ -138,7 +268,8 @@ def sync(args):
     total = len(files)
     logger.info(f"Starting sync of {total} files using {args.workers} threads. Dry run: {args.dry_run}")
 
-    db_urls = get_db_urls()
+    rows_by_name = index_db_rows(get_db_urls(args.stream, args.fetch_size))
+    fuzzy_index = FuzzyIndex(rows_by_name)
     results = {
         "uploaded": 0,
         "skipped": 0,
@@ -149,6 +280,9 @@ def sync(args):
     }
 
     file_log = []
+    # The worker threads share `db`, so updates and the commits between them take turns
+    db_lock = threading.Lock()
+    committer = ChunkedCommitter(db, "sync", args.commit_rows, args.commit_seconds)
 
     def safe_name(name):
         return name.encode("utf-8", errors="replace").decode("utf-8")
@@ -178,20 +312,21 @@ def sync(args):
 
             logger.info(f"[UPLOAD] {safe_filename} → {s3_key} [ETag: {etag}]")
 
-            match = next((row for row in db_urls if normalize_filename(row["url"].split("/")[-1]) == normalize_filename(filename)), None)
+            match = rows_by_name.get(normalize_filename(filename))
             used_fuzzy = False
 
             if not match:
-                match = find_best_match(filename, db_urls)
+                match = find_best_match(filename, rows_by_name, fuzzy_index)
                 used_fuzzy = True
 
             if match:
                 if not args.dry_run:
-                    with db.cursor() as cursor:
+                    with db_lock, db.cursor() as cursor:
                         cursor.execute(
                             f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s, url = %s WHERE id = %s",
                             (etag, path_for_db, filename, match["id"])
                         )
+                        committer.tick()
                 action = "fuzzy_match" if used_fuzzy else "updated"
                 file_log.append({"filename": safe_filename, "action": action, "etag": etag})
                 logger.info(f"[DB] Updated ID {match['id']} for {safe_filename} {'(fuzzy match)' if used_fuzzy else ''}")
@@ -213,7 +348,7 @@ def sync(args):
             results[result_type] += 1
 
     if not args.dry_run:
-        db.commit()
+        committer.finish()
 
     logger.info("=== SYNC SUMMARY ===")
     for k, v in results.items():
@@ -245,6 +380,10 @@ if __name__ == "__main__":
     sync_parser = sub.add_parser("sync", help="Upload files and update DB in one pass")
     sync_parser.add_argument("--dry-run", action="store_true", help="Perform a dry run (no changes)")
     sync_parser.add_argument("--workers", type=int, default=5, help="Number of parallel threads (default: 5)")
+    sync_parser.add_argument("--stream", action="store_true", help="Stream table rows with a server-side cursor")
+    sync_parser.add_argument("--fetch-size", type=int, default=STREAM_FETCH_SIZE, help=f"Rows per fetch when streaming (default: {STREAM_FETCH_SIZE})")
+    sync_parser.add_argument("--commit-rows", type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many updated rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+    sync_parser.add_argument("--commit-seconds", type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
 
     args = parser.parse_args()
 
@@ -324,18 +463,39 @@ if __name__ == "__main__":
 import os
 import sys
 import csv
+import json
+import math
 import time
+import heapq
 import boto3
+import hashlib
+import sqlite3
+import tempfile
+import itertools
+import threading
 import pymysql
+import zlib
 import logging
 import urllib3
 import argparse
+import random
 import unicodedata
+import multiprocessing
+from array import array
 from pathlib import Path
-from difflib import get_close_matches
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
 from urllib.parse import unquote
+from botocore.config import Config
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 sys.stdout.reconfigure(encoding='utf-8', errors='replace')
 
@@ -355,7 +515,66 @@ SOURCE_DIR = "Y:/path/to/share"
 TARGET_PREFIX = "legacy/"
 ORPHAN_CSV = "orphaned_s3_files.csv"
 INSERT_LOG_CSV = "imported_orphan_files.csv"
+IMPORT_FAILED_CSV = "failed_orphan_imports.csv"
 UNMATCHED_OUTPUT = "unmatched_files.csv"
+CHECKPOINT_FILE = "reconcile_checkpoint.json"
+CHECKPOINT_UNMATCHED = "reconcile_checkpoint_unmatched.csv"
+WATERMARK_FILE = "reconcile_watermark.json"
+LEGACY_URL_PREFIXES = ("http://server/artifacts/", "https://server/artifacts/")
+LEGACY_URL_PATTERNS = tuple(f"{prefix}%" for prefix in LEGACY_URL_PREFIXES)
+LEGACY_URL_PREFIXES_ENCODED = tuple(prefix.encode() for prefix in LEGACY_URL_PREFIXES)
+LEGACY_URL_PREFIX_BYTES = max(map(len, LEGACY_URL_PREFIXES_ENCODED))
+
+STREAM_FETCH_SIZE = 10000
+STREAM_NET_WRITE_TIMEOUT = 3600
+
+LIST_WORKERS = 16
+LIST_SHARD_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+MANIFEST_DB = "s3_manifest.sqlite"
+MANIFEST_MAX_AGE = 24 * 3600
+
+SORT_RUN_SIZE = 1000000
+BLOOM_ERROR_RATE = 0.01
+BLOOM_CONFIRM_BATCH = 1000
+ORPHAN_CLASSIFY_BATCH = 1000
+
+IMPORT_WORKERS = 8
+DELETE_BATCH_SIZE = 1000
+INSERT_BATCH_SIZE = 1000
+MULTIPART_COPY_THRESHOLD = 512 * 1024 * 1024
+MULTIPART_PART_SIZE = 256 * 1024 * 1024
+MULTIPART_PART_WORKERS = 8
+MULTIPART_MAX_PARTS = 10000
+# Object headers a multipart copy has to carry over itself; copy_object keeps them
+MULTIPART_COPY_HEADERS = ("ContentType", "Metadata", "CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage", "Expires")
+# Pooled connections for the shared client: import copies each fan out to part copies
+S3_MAX_CONNECTIONS = max(IMPORT_WORKERS * MULTIPART_PART_WORKERS, LIST_WORKERS)
+
+COMMIT_EVERY_ROWS = 10000
+COMMIT_EVERY_SECONDS = 0
+
+RANGES_PER_WORKER = 4
+
+STAGING_TABLE = "reconcile_staging"
+STAGING_BATCH_SIZE = 5000
+
+NORM_COLUMNS = ("filename_norm", "path_norm")
+NORM_COLUMN_TYPE = "VARCHAR(1024) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin"
+NORM_INDEX_PREFIX = 191
+NORM_STAGING_TABLE = "norm_staging"
+NORM_BACKFILL_BATCH = 10000
+KEYS_TABLE = "s3_keys_staging"
+NORM_TRIGGER = "files_norm_invalidate"
+NORM_CHECK_SAMPLE = 1000
+SQL_JOIN_CHUNK_IDS = 50000
+
+FUZZY_CUTOFF = 0.85
+FUZZY_SHORTLIST = 50
+FUZZY_BATCH_SIZE = 500
+FUZZY_BLOCK_ROWS = 20000
+FUZZY_VECTOR_DIM = 256
+FUZZY_VECTOR_CELLS = 16 * 1024 * 1024
 
 # === LOGGING ===
 logging.basicConfig(
@@ -371,16 +590,104 @@ s3 = boto3.client(
     aws_access_key_id=ACCESS_KEY,
     aws_secret_access_key=SECRET_KEY,
     endpoint_url=ENDPOINT_URL,
-    verify=False
+    verify=False,
+    config=Config(max_pool_connections=S3_MAX_CONNECTIONS)
 )
 
-db = pymysql.connect(
-    host=DB_HOST,
-    user=DB_USER,
-    password=DB_PASS,
-    database=DB_NAME,
-    cursorclass=pymysql.cursors.DictCursor
-)
+def connect_db(cursorclass=pymysql.cursors.DictCursor):
+    return pymysql.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASS,
+        database=DB_NAME,
+        cursorclass=cursorclass,
+        # Marks this tool's sessions, whose writes keep the normalized columns current,
+        # so the NORM_TRIGGER only invalidates them for writes from other clients
+        init_command="SET @norm_columns_managed = 1"
+    )
+
+db = connect_db()
+
+# === PARALLEL LISTING ===
+# Splits the keyspace under `prefix` at prefix + <char> boundaries. Each shard lists
+# (lower, upper] with StartAfter=lower and stops past upper, so the shards cover every
+# key exactly once and yielding them in order keeps S3's lexicographic key order.
+def list_objects_shard(prefix, lower, upper):
+    objects = []
+    params = {"Bucket": BUCKET_NAME, "Prefix": prefix}
+    if lower:
+        params["StartAfter"] = lower
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        for obj in page.get("Contents", []):
+            if upper and obj["Key"] > upper:
+                return objects
+            objects.append(obj)
+    return objects
+
+def list_objects_parallel(prefix, workers=LIST_WORKERS):
+    bounds = [f"{prefix}{c}" for c in LIST_SHARD_CHARS] if workers > 1 else []
+    shards = list(zip([None] + bounds, bounds + [None]))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for objects in executor.map(lambda shard: list_objects_shard(prefix, *shard), shards):
+            yield from objects
+
+# === MANIFEST ===
+# Local SQLite copy of the bucket listing. Every key this tool writes or removes is
+# written through, but other writers to the bucket are not seen, so commands re-list by
+# default and only load the manifest (while younger than MANIFEST_MAX_AGE) when given
+# --trust-manifest.
+manifest = sqlite3.connect(MANIFEST_DB, check_same_thread=False)
+manifest.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, etag TEXT, size INTEGER, last_modified TEXT)")
+manifest.execute("CREATE TABLE IF NOT EXISTS listings (prefix TEXT PRIMARY KEY, listed_at REAL)")
+manifest.execute("CREATE TABLE IF NOT EXISTS fuzzy_cache (scope TEXT, name TEXT, version TEXT, match TEXT, score REAL, PRIMARY KEY (scope, name))")
+manifest.commit()
+manifest_lock = threading.Lock()
+
+def prefix_range(prefix):
+    # every key starting with `prefix` sorts in [prefix, upper)
+    if not prefix:
+        return "", "\U0010ffff"
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def manifest_put(key, etag, size, last_modified=None):
+    last_modified = last_modified or datetime.now(timezone.utc)
+    with manifest_lock:
+        manifest.execute(
+            "INSERT OR REPLACE INTO objects (key, etag, size, last_modified) VALUES (?, ?, ?, ?)",
+            (key, etag, size, last_modified.isoformat())
+        )
+        manifest.commit()
+
+def manifest_delete(key):
+    with manifest_lock:
+        manifest.execute("DELETE FROM objects WHERE key = ?", (key,))
+        manifest.commit()
+
+def refresh_manifest(prefix):
+    s3_index = {}
+    for obj in list_objects_parallel(prefix):
+        s3_index[obj["Key"]] = (obj.get("ETag", "").strip('"'), obj["Size"], obj["LastModified"])
+
+    with manifest_lock:
+        known = {
+            key: (etag, size)
+            for key, etag, size in manifest.execute(
+                "SELECT key, etag, size FROM objects WHERE key >= ? AND key < ?", prefix_range(prefix)
+            )
+        }
+        changed = [
+            (key, etag, size, last_modified.isoformat())
+            for key, (etag, size, last_modified) in s3_index.items()
+            if known.get(key) != (etag, size)
+        ]
+        removed = [(key,) for key in known if key not in s3_index]
+        manifest.executemany("INSERT OR REPLACE INTO objects (key, etag, size, last_modified) VALUES (?, ?, ?, ?)", changed)
+        manifest.executemany("DELETE FROM objects WHERE key = ?", removed)
+        manifest.execute("INSERT OR REPLACE INTO listings (prefix, listed_at) VALUES (?, ?)", (prefix, time.time()))
+        manifest.commit()
+    logger.info(f"Refreshed manifest for {prefix}: {len(s3_index)} keys, {len(changed)} added/changed, {len(removed)} removed")
+    return s3_index
 
 # === HELPERS ===
 def normalize_filename(name):
@@ -405,25 +712,1628 @@ def upload_file(local_path, s3_key):
                 Key=s3_key,
                 Body=data
             )
-        return response.get('ETag', '').strip('"')
+        etag = response.get('ETag', '').strip('"')
+        manifest_put(s3_key, etag, os.path.getsize(local_path))
+        return etag
     except Exception as e:
         logger.error(f"Error uploading {local_path}: {e}")
         return None
 
-def get_db_urls():
-    with db.cursor() as cursor:
-        cursor.execute(f"SELECT id, url FROM {TABLE_NAME}")
+# Unbuffered read on its own connection, so writes on `db` never interrupt the stream.
+# The server holds the result set while we work, hence the raised net_write_timeout.
+def stream_rows(sql, params=None, fetch_size=STREAM_FETCH_SIZE):
+    read_db = connect_db(pymysql.cursors.SSDictCursor)
+    try:
+        with read_db.cursor() as cursor:
+            cursor.execute(f"SET SESSION net_write_timeout = {STREAM_NET_WRITE_TIMEOUT}")
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+    finally:
+        read_db.close()
+
+def fetch_rows(sql, params=None, stream=False, fetch_size=STREAM_FETCH_SIZE, conn=None):
+    if stream:
+        return stream_rows(sql, params, fetch_size)
+    with (conn or db).cursor() as cursor:
+        cursor.execute(sql, params)
         return cursor.fetchall()
 
-def find_best_match(filename, candidates):
-    names = [normalize_filename(c['url'].split("/")[-1]) for c in candidates]
-    match = get_close_matches(normalize_filename(filename), names, n=1, cutoff=0.85)
-    if match:
-        for c in candidates:
-            if normalize_filename(c['url'].split("/")[-1]) == match[0]:
-                return c
+# (id, url) rows stored by column instead of one dict per row: ids in an array('q') and
+# all urls UTF-8 encoded into one buffer with an offset array. `names` holds the
+# normalized filename only where normalizing changed the url's last segment (interned,
+# "" for no name); None means name(i) reads the segment straight from the buffer, which
+# is the common case. row(i) rebuilds the dict the rest of the tool expects. by_name()
+# maps each name to its first row index; it is built on first use and kept current by add().
+class DbRows:
+    def __init__(self):
+        self.ids = array('q')
+        self.names = []
+        self.url_buffer = bytearray()
+        self.url_offsets = array('q', [0])
+        self.null_urls = set()
+        self.name_index = None
+
+    @classmethod
+    def load(cls, rows):
+        db_rows = cls()
+        for row in rows:
+            db_rows.add(row["id"], row["url"])
+        return db_rows
+
+    def add(self, row_id, url):
+        index = len(self.ids)
+        name = None
+        self.ids.append(row_id)
+        if url is None:
+            self.null_urls.add(index)
+            self.names.append("")
+        else:
+            self.url_buffer += url.encode("utf-8", "surrogatepass")
+            segment = url.split("/")[-1]
+            name = normalize_filename(segment)
+            self.names.append(None if name == segment else sys.intern(name or ""))
+        self.url_offsets.append(len(self.url_buffer))
+        if self.name_index is not None and name:
+            self.name_index.setdefault(name, index)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self.ids)))
+
+    def url(self, i):
+        if i in self.null_urls:
+            return None
+        return self.url_buffer[self.url_offsets[i]:self.url_offsets[i + 1]].decode("utf-8", "surrogatepass")
+
+    def name(self, i):
+        name = self.names[i]
+        if name is not None:
+            return name or None
+        start, end = self.url_offsets[i], self.url_offsets[i + 1]
+        slash = self.url_buffer.rfind(b"/", start, end)
+        return self.url_buffer[slash + 1 if slash >= 0 else start:end].decode("utf-8", "surrogatepass")
+
+    def has_legacy_url(self, i):
+        start = self.url_offsets[i]
+        head = self.url_buffer[start:min(start + LEGACY_URL_PREFIX_BYTES, self.url_offsets[i + 1])].lower()
+        return head.startswith(LEGACY_URL_PREFIXES_ENCODED)
+
+    # The matching name of a row still on a legacy URL, read without decoding the URL
+    def legacy_name(self, i):
+        return self.name(i) if self.has_legacy_url(i) else None
+
+    def row(self, i):
+        return {"id": self.ids[i], "url": self.url(i)}
+
+    def by_name(self):
+        if self.name_index is None:
+            self.name_index = {}
+            duplicates = set()
+            for i in range(len(self.ids)):
+                name = self.name(i)
+                if name and self.name_index.setdefault(name, i) != i:
+                    duplicates.add(name)
+            if duplicates:
+                logger.warning(f"{len(duplicates)} filenames map to more than one DB row, the first row returned is used")
+        return self.name_index
+
+    def find(self, name):
+        index = self.by_name().get(name)
+        return self.row(index) if index is not None else None
+
+    def memory_bytes(self):
+        return (
+            self.ids.itemsize * len(self.ids) + len(self.url_buffer) + self.url_offsets.itemsize * len(self.url_offsets)
+            + sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in set(self.names) if name)
+        )
+
+# Reads `sql` through an unbuffered cursor on `conn` a fetch at a time, so the result is
+# never held as a list of dicts. Callers must drain it before using `conn` again.
+def unbuffered_rows(sql, params=None, fetch_size=STREAM_FETCH_SIZE, conn=None):
+    with (conn or db).cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+
+def load_db_rows(sql, params=None, fetch_size=STREAM_FETCH_SIZE, conn=None):
+    db_rows = DbRows.load(unbuffered_rows(sql, params, fetch_size, conn))
+    logger.info(f"Loaded {len(db_rows)} DB rows into {db_rows.memory_bytes() / (1024 * 1024):.1f} MB")
+    return db_rows
+
+# One pass over the table keeping only the rows whose name is in `wanted` (added to
+# `db_rows`), plus, with collect_names, the distinct name of every row for the fuzzy
+# index. Memory is the kept rows and the names, never one object per table row.
+def scan_db_rows(wanted, stream=False, fetch_size=STREAM_FETCH_SIZE, db_rows=None, collect_names=False):
+    wanted = set(wanted)
+    db_rows = db_rows if db_rows is not None else DbRows()
+    names = set()
+    sql = f"SELECT id, url FROM {TABLE_NAME}"
+    for row in stream_rows(sql, fetch_size=fetch_size) if stream else unbuffered_rows(sql, fetch_size=fetch_size):
+        name = normalize_filename(row["url"].split("/")[-1]) if row["url"] else None
+        if not name:
+            continue
+        if collect_names:
+            names.add(name)
+        if name in wanted:
+            db_rows.add(row["id"], row["url"])
+    logger.info(f"Scanned {TABLE_NAME}: kept {len(db_rows)} rows" + (f", {len(names)} distinct names" if collect_names else ""))
+    return db_rows, names
+
+def find_best_match(filename, db_rows, fuzzy_matches):
+    best = fuzzy_matches.get(normalize_filename(filename))
+    if best:
+        return db_rows.find(best[0])
     return None
 
+# Staged rows carry the normalized columns too once they are installed, see norm_values().
+def staging_columns(conn=None):
+    return ("id", "hcp_id", "path", "url", *(NORM_COLUMNS if has_norm_columns(conn) else ()))
+
+# Temporary tables are per-connection, so staging and merge must both run on `db`.
+def create_staging_table(cursor):
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {STAGING_TABLE} AS SELECT {', '.join(staging_columns(cursor.connection))} "
+        f"FROM {TABLE_NAME} WHERE 1 = 0"
+    )
+    cursor.execute(f"ALTER TABLE {STAGING_TABLE} ADD PRIMARY KEY (id)")
+
+def stage_rows(cursor, rows):
+    columns = staging_columns(cursor.connection)
+    # pymysql batches executemany() INSERT ... VALUES into multi-row statements
+    cursor.executemany(
+        f"INSERT INTO {STAGING_TABLE} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+        rows
+    )
+
+def merge_staging(cursor):
+    cursor.execute(
+        f"UPDATE {TABLE_NAME} t JOIN {STAGING_TABLE} s ON t.id = s.id "
+        f"SET {', '.join(f't.{column} = s.{column}' for column in staging_columns(cursor.connection)[1:])}"
+    )
+    merged = cursor.rowcount
+    cursor.execute(f"TRUNCATE TABLE {STAGING_TABLE}")
+    return merged
+
+# Commits whenever `every_rows` writes or `every_seconds` have accumulated (0 disables
+# either limit) and logs each chunk's size and timing. Callers sharing a connection
+# across threads must serialize tick()/commit() themselves.
+class ChunkedCommitter:
+    def __init__(self, conn, label, every_rows=COMMIT_EVERY_ROWS, every_seconds=COMMIT_EVERY_SECONDS, before_commit=None, after_commit=None):
+        self.conn = conn
+        self.label = label
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.before_commit = before_commit
+        self.after_commit = after_commit
+        self.pending = 0
+        self.committed = 0
+        self.chunks = 0
+        self.chunk_start = time.monotonic()
+
+    def tick(self, rows=1):
+        self.pending += rows
+        if self.every_rows and self.pending >= self.every_rows:
+            self.commit()
+        elif self.every_seconds and time.monotonic() - self.chunk_start >= self.every_seconds:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        if self.before_commit:
+            self.before_commit()
+        commit_start = time.monotonic()
+        self.conn.commit()
+        if self.after_commit:
+            self.after_commit()
+        now = time.monotonic()
+        elapsed = now - self.chunk_start
+        self.chunks += 1
+        self.committed += self.pending
+        logger.info(
+            f"[COMMIT] {self.label} chunk {self.chunks}: {self.pending} rows in {elapsed:.2f}s "
+            f"({self.pending / elapsed if elapsed else 0:.0f} rows/s, commit {now - commit_start:.2f}s)"
+        )
+        self.pending = 0
+        self.chunk_start = now
+
+    def finish(self):
+        self.commit()
+        logger.info(f"[COMMIT] {self.label}: {self.committed} rows committed in {self.chunks} chunks")
+
+# === KEY STORE ===
+# Strings packed into one UTF-8 bytearray; item i is the bytes between offsets i and
+# i + 1, so the packed strings form a sequence bisect can search directly.
+class PackedStrings:
+    def __init__(self, strings):
+        self.blob = bytearray()
+        self.offsets = array('q', [0])
+        for string in strings:
+            self.blob += string.encode("utf-8", "surrogatepass")
+            self.offsets.append(len(self.blob))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+    def string(self, i):
+        return self[i].decode("utf-8", "surrogatepass")
+
+    def memory_bytes(self):
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+# `last_modified` from a listing (datetime) or the manifest (ISO string) as epoch seconds
+def epoch_seconds(last_modified):
+    if not last_modified:
+        return math.nan
+    if isinstance(last_modified, str):
+        last_modified = datetime.fromisoformat(last_modified)
+    return last_modified.timestamp()
+
+# The S3 keys under one prefix with their ETags, sizes and modification times, stored
+# once with the prefix stripped and sorted. UTF-8 byte order is code point order (S3's
+# listing order), so exact lookups and prefix spans bisect the packed names. get() and
+# items() return the same (etag, size, last_modified) entries as the old dict index;
+# times are kept as epoch seconds (NaN when unknown) and come back as UTC datetimes.
+# Case/NFC-insensitive lookups (the find-orphans comparison) use a second sorted copy of
+# the folded names, built on first use, with a permutation back to the key order.
+class KeyStore:
+    def __init__(self, prefix, entries):
+        self.prefix = prefix
+        entries = sorted(
+            (key[len(prefix):], etag, size, last_modified)
+            for key, etag, size, last_modified in entries if key.startswith(prefix)
+        )
+        self.names = PackedStrings(name for name, _, _, _ in entries)
+        self.etags = PackedStrings(etag or "" for _, etag, _, _ in entries)
+        self.sizes = array('q', (size or 0 for _, _, size, _ in entries))
+        self.modified = array('d', (epoch_seconds(last_modified) for _, _, _, last_modified in entries))
+        self.folded = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return (self.key(i) for i in range(len(self)))
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+
+    def key(self, i):
+        return self.prefix + self.names.string(i)
+
+    def entry(self, i):
+        modified = self.modified[i]
+        return self.etags.string(i), self.sizes[i], None if math.isnan(modified) else datetime.fromtimestamp(modified, timezone.utc)
+
+    def index(self, key):
+        if not key.startswith(self.prefix):
+            return -1
+        target = key[len(self.prefix):].encode("utf-8", "surrogatepass")
+        i = bisect_left(self.names, target)
+        return i if i < len(self.names) and self.names[i] == target else -1
+
+    def get(self, key, default=None):
+        i = self.index(key)
+        return self.entry(i) if i >= 0 else default
+
+    def items(self):
+        return ((self.key(i), self.entry(i)) for i in range(len(self)))
+
+    def iter_names(self):
+        return (self.names.string(i) for i in range(len(self)))
+
+    # Index range [lo, hi) of the keys starting with `prefix`. No UTF-8 byte is 0xFF, so
+    # appending one bounds every name that extends the prefix.
+    def span(self, prefix):
+        if self.prefix.startswith(prefix):
+            return 0, len(self)
+        if not prefix.startswith(self.prefix):
+            return 0, 0
+        target = prefix[len(self.prefix):].encode("utf-8", "surrogatepass")
+        return bisect_left(self.names, target), bisect_left(self.names, target + b"\xff")
+
+    def scan(self, prefix):
+        lo, hi = self.span(prefix)
+        return (self.key(i) for i in range(lo, hi))
+
+    # Folded names keep the folded store prefix stripped too; the odd key whose folded form
+    # no longer starts with it (unquoting or NFC across the boundary) goes in a small dict.
+    def build_folded(self):
+        self.folded_prefix = orphan_match_key(self.prefix)
+        folded = []
+        extra = defaultdict(list)
+        for i in range(len(self)):
+            key = orphan_match_key(self.key(i))
+            if key.startswith(self.folded_prefix):
+                folded.append((key[len(self.folded_prefix):], i))
+            else:
+                extra[key].append(i)
+        folded.sort()
+        self.folded_order = array('q', (i for _, i in folded))
+        self.folded_extra = dict(extra)
+        self.folded = PackedStrings(key for key, _ in folded)
+
+    # Indexes of every key equal to `key` ignoring case and Unicode normalization
+    def find_folded(self, key):
+        if self.folded is None:
+            self.build_folded()
+        key = orphan_match_key(key)
+        matches = list(self.folded_extra.get(key, ()))
+        if key.startswith(self.folded_prefix):
+            target = key[len(self.folded_prefix):].encode("utf-8", "surrogatepass")
+            i = bisect_left(self.folded, target)
+            while i < len(self.folded) and self.folded[i] == target:
+                matches.append(self.folded_order[i])
+                i += 1
+        return matches
+
+    def memory_bytes(self):
+        total = (
+            self.names.memory_bytes() + self.etags.memory_bytes()
+            + self.sizes.itemsize * len(self.sizes) + self.modified.itemsize * len(self.modified)
+        )
+        if self.folded is not None:
+            total += self.folded.memory_bytes() + self.folded_order.itemsize * len(self.folded_order)
+        return total
+
+def manifest_age(prefix):
+    with manifest_lock:
+        listed = manifest.execute("SELECT listed_at FROM listings WHERE prefix = ?", (prefix,)).fetchone()
+    return time.time() - listed[0] if listed else None
+
+def get_s3_index(prefix, refresh=False):
+    age = manifest_age(prefix)
+    if refresh or age is None or age > MANIFEST_MAX_AGE:
+        listing = refresh_manifest(prefix)
+        s3_index = KeyStore(prefix, ((key, *entry) for key, entry in listing.items()))
+        del listing
+    else:
+        with manifest_lock:
+            s3_index = KeyStore(prefix, manifest.execute(
+                "SELECT key, etag, size, last_modified FROM objects WHERE key >= ? AND key < ?", prefix_range(prefix)
+            ))
+        logger.info(f"Loaded manifest listed {age / 60:.0f} min ago")
+    logger.info(f"Indexed {len(s3_index)} S3 keys under {prefix} in {s3_index.memory_bytes() / (1024 * 1024):.1f} MB")
+    return s3_index
+
+# Yields (key, etag, size) one at a time from a fresh manifest (SQLite's binary TEXT order
+# is S3's key order) or straight from the paginator, without building an index in memory.
+def iter_s3_objects(prefix, refresh=False):
+    age = manifest_age(prefix)
+    if not refresh and age is not None and age <= MANIFEST_MAX_AGE:
+        logger.info(f"Streaming keys from manifest listed {age / 60:.0f} min ago")
+        yield from manifest.execute(
+            "SELECT key, etag, size FROM objects WHERE key >= ? AND key < ? ORDER BY key", prefix_range(prefix)
+        )
+        return
+    logger.info(f"Streaming keys from the bucket listing under {prefix}")
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"], obj.get("ETag", "").strip('"'), obj["Size"]
+
+def index_etag(s3_index, key):
+    entry = s3_index.get(key)
+    return entry[0] if entry else None
+
+def verify_index_sample(s3_index, keys, sample_size):
+    sample = random.sample(keys, min(sample_size, len(keys)))
+    mismatched = 0
+    for key in sample:
+        etag = s3_object_exists(key)
+        if etag != index_etag(s3_index, key):
+            mismatched += 1
+            logger.warning(f"[VERIFY] {key} listing ETag {index_etag(s3_index, key)} != HEAD ETag {etag}")
+    logger.info(f"Verified {len(sample)} matched keys with HEAD, {mismatched} mismatched")
+
+# === NORMALIZED COLUMNS ===
+# filename_norm holds the matching name every tool derives from url (last segment,
+# unquoted, NFC) and path_norm the find-orphans key for path (lower-case, NFC). MySQL
+# has no NFC or URL-decoding, so they are computed here rather than as generated
+# columns: `normalize-columns` adds and backfills them, and every write of url or path
+# in this tool keeps them current. Writes from other clients are caught by a BEFORE
+# UPDATE trigger that resets both columns to NULL, and norm_columns_usable() refuses the
+# SQL paths while any are NULL or a sample disagrees with Python. Both use a binary
+# collation so joins compare exactly what Python compares.
+norm_columns_installed = None
+norm_columns_checked = None
+
+def url_filename_norm(url):
+    if url is None:
+        return None
+    return normalize_filename(url.split("/")[-1]) or ""
+
+def path_norm(path):
+    return orphan_match_key(path) if path is not None else None
+
+def has_norm_columns(conn=None):
+    global norm_columns_installed
+    if norm_columns_installed is None:
+        with (conn or db).cursor() as cursor:
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME IN ({', '.join(['%s'] * len(NORM_COLUMNS))})",
+                (TABLE_NAME, *NORM_COLUMNS)
+            )
+            norm_columns_installed = len(cursor.fetchall()) == len(NORM_COLUMNS)
+    return norm_columns_installed
+
+# Values for the normalized columns matching a write of `url` and `path`, or () when
+# the columns are not installed.
+def norm_values(url, path, conn=None):
+    return (url_filename_norm(url), path_norm(path)) if has_norm_columns(conn) else ()
+
+def norm_assignments(url, path, conn=None):
+    values = norm_values(url, path, conn)
+    return "".join(f", {column} = %s" for column in NORM_COLUMNS[:len(values)]), values
+
+# Rows whose url or path is set but not yet normalized; the SQL paths are not used while
+# any remain, since the joins would silently miss them.
+def norm_backfill_pending():
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM {TABLE_NAME} WHERE (filename_norm IS NULL AND url IS NOT NULL) "
+            f"OR (path_norm IS NULL AND path IS NOT NULL) LIMIT 1"
+        )
+        return cursor.fetchone() is not None
+
+# Rows among the newest `sample` whose stored normalized values differ from Python's,
+# e.g. written by another client before the trigger was installed.
+def norm_mismatches(sample=NORM_CHECK_SAMPLE):
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, url, path, filename_norm, path_norm FROM {TABLE_NAME} ORDER BY id DESC LIMIT %s", (sample,)
+        )
+        return [
+            row["id"] for row in cursor.fetchall()
+            if (row["filename_norm"], row["path_norm"]) != (url_filename_norm(row["url"]), path_norm(row["path"]))
+        ]
+
+# Whether the indexed joins on the normalized columns can be trusted for this run
+def norm_columns_usable():
+    global norm_columns_checked
+    if norm_columns_checked is None:
+        if not has_norm_columns():
+            reason = f"{TABLE_NAME} has no filename_norm/path_norm, run normalize-columns"
+        elif norm_backfill_pending():
+            reason = "some rows are not normalized, run normalize-columns"
+        else:
+            mismatched = norm_mismatches()
+            reason = f"{len(mismatched)} sampled rows disagree, e.g. id {mismatched[0]}, run normalize-columns --all" if mismatched else None
+        if reason:
+            logger.warning(f"Normalized columns are not usable: {reason}")
+        norm_columns_checked = reason is None
+    return norm_columns_checked
+
+def install_norm_columns():
+    global norm_columns_installed
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (TABLE_NAME,)
+        )
+        existing = {row["COLUMN_NAME"] for row in cursor.fetchall()}
+        clauses = []
+        for column in NORM_COLUMNS:
+            if column not in existing:
+                clauses.append(f"ADD COLUMN {column} {NORM_COLUMN_TYPE} NULL")
+                clauses.append(f"ADD INDEX idx_{column} ({column}({NORM_INDEX_PREFIX}))")
+        if clauses:
+            logger.info(f"Adding {', '.join(c for c in NORM_COLUMNS if c not in existing)} to {TABLE_NAME}")
+            cursor.execute(f"ALTER TABLE {TABLE_NAME} {', '.join(clauses)}")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {NORM_TRIGGER}")
+        try:
+            cursor.execute(
+                f"CREATE TRIGGER {NORM_TRIGGER} BEFORE UPDATE ON {TABLE_NAME} FOR EACH ROW "
+                f"BEGIN IF @norm_columns_managed IS NULL THEN "
+                f"IF NOT (NEW.url <=> OLD.url) THEN SET NEW.filename_norm = NULL; END IF; "
+                f"IF NOT (NEW.path <=> OLD.path) THEN SET NEW.path_norm = NULL; END IF; "
+                f"END IF; END"
+            )
+        except pymysql.MySQLError as e:
+            logger.warning(f"Could not create {NORM_TRIGGER}, other clients' writes are only caught by the sample check → {e}")
+    norm_columns_installed = True
+
+# Walks the table in id order a batch at a time and applies each batch with one
+# UPDATE ... JOIN from a staging table. Without --all only rows still missing a value
+# are visited, so an interrupted backfill just picks up where it stopped.
+def normalize_columns(args):
+    install_norm_columns()
+    pending = "((filename_norm IS NULL AND url IS NOT NULL) OR (path_norm IS NULL AND path IS NOT NULL))"
+    committer = ChunkedCommitter(db, "normalize-columns", args.commit_rows, args.commit_seconds)
+    last_id = None
+    with db.cursor() as cursor:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {NORM_STAGING_TABLE}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {NORM_STAGING_TABLE} "
+            f"(id BIGINT PRIMARY KEY, filename_norm {NORM_COLUMN_TYPE} NULL, path_norm {NORM_COLUMN_TYPE} NULL)"
+        )
+        while True:
+            conditions = [] if args.all else [pending]
+            if last_id is not None:
+                conditions.append("id > %s")
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            cursor.execute(
+                f"SELECT id, url, path FROM {TABLE_NAME}{where} ORDER BY id LIMIT %s",
+                (*((last_id,) if last_id is not None else ()), args.batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                f"INSERT INTO {NORM_STAGING_TABLE} (id, filename_norm, path_norm) VALUES (%s, %s, %s)",
+                [(row["id"], url_filename_norm(row["url"]), path_norm(row["path"])) for row in rows]
+            )
+            cursor.execute(
+                f"UPDATE {TABLE_NAME} t JOIN {NORM_STAGING_TABLE} s ON t.id = s.id "
+                f"SET t.filename_norm = s.filename_norm, t.path_norm = s.path_norm"
+            )
+            cursor.execute(f"TRUNCATE TABLE {NORM_STAGING_TABLE}")
+            last_id = rows[-1]["id"]
+            committer.tick(len(rows))
+    committer.finish()
+
+# Per-connection staging table of S3 keys (or local file names) for the --sql-join
+# modes. key_name is what filename_norm is joined on, the other normalized values are
+# what a row pointing at s3_key gets written.
+def create_keys_table(cursor):
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {KEYS_TABLE}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {KEYS_TABLE} ("
+        f"s3_key {NORM_COLUMN_TYPE} NOT NULL, etag VARCHAR(64) NULL, size BIGINT NULL, "
+        f"key_name {NORM_COLUMN_TYPE} NULL, key_filename_norm {NORM_COLUMN_TYPE} NULL, key_path_norm {NORM_COLUMN_TYPE} NULL, "
+        f"INDEX (key_name({NORM_INDEX_PREFIX})), INDEX (key_path_norm({NORM_INDEX_PREFIX})))"
+    )
+
+# `entries` are (s3_key, etag, size, key_name) tuples
+def stage_keys(cursor, entries):
+    staged = 0
+    for batch in iter(lambda: list(itertools.islice(entries, STAGING_BATCH_SIZE)), []):
+        cursor.executemany(
+            f"INSERT INTO {KEYS_TABLE} (s3_key, etag, size, key_name, key_filename_norm, key_path_norm) "
+            f"VALUES (%s, %s, %s, %s, %s, %s)",
+            [
+                (key, etag, size, name or None, url_filename_norm(key), path_norm(key))
+                for key, etag, size, name in batch
+            ]
+        )
+        staged += len(batch)
+    logger.info(f"Staged {staged} keys in {KEYS_TABLE}")
+    return staged
+
+# Adds the rows whose filename_norm equals one of `names` to `db_rows` (a new DbRows by
+# default) and returns it
+def join_db_rows(names, db_rows=None):
+    db_rows = db_rows if db_rows is not None else DbRows()
+    with db.cursor() as cursor:
+        create_keys_table(cursor)
+        if not stage_keys(cursor, iter((f"{TARGET_PREFIX}{name}", None, None, name) for name in set(names) if name)):
+            return db_rows
+        cursor.execute(
+            f"SELECT t.id, t.url FROM {KEYS_TABLE} k "
+            f"JOIN {TABLE_NAME} t ON t.filename_norm = k.key_name ORDER BY t.id"
+        )
+        for row in cursor.fetchall():
+            db_rows.add(row["id"], row["url"])
+    return db_rows
+
+def id_chunks(size, conn=None):
+    with (conn or db).cursor() as cursor:
+        cursor.execute(f"SELECT MIN(id) AS lo, MAX(id) AS hi FROM {TABLE_NAME}")
+        bounds = cursor.fetchone()
+    if bounds["lo"] is None:
+        return []
+    return [(start, min(start + size - 1, bounds["hi"])) for start in range(bounds["lo"], bounds["hi"] + 1, size)]
+
+# === FUZZY INDEX ===
+# Trigram postings over the normalized names, ordered by name length so a lookup only
+# counts shared grams inside the length band where the ratio can reach the cutoff.
+# The names sharing the most grams are then scored exactly like get_close_matches().
+# With build_vectors(), best_many() shortlists by cosine similarity of hashed gram count
+# vectors instead, scoring a whole (names x candidates) block per NumPy matrix product.
+class FuzzyIndex:
+    def __init__(self, names, gram_size=3, shortlist=FUZZY_SHORTLIST):
+        self.gram_size = gram_size
+        self.shortlist = shortlist
+        self.names = sorted({name for name in names if name}, key=len)
+        self.lengths = [len(name) for name in self.names]
+        self.postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in self.grams(name):
+                self.postings[gram].append(i)
+        self.vectors = None
+        logger.info(f"Built fuzzy index over {len(self.names)} names ({len(self.postings)} trigrams)")
+
+    def grams(self, name):
+        pad = " " * (self.gram_size - 1)
+        padded = f"{pad}{name}{pad}"
+        return {padded[i:i + self.gram_size] for i in range(len(padded) - self.gram_size + 1)}
+
+    def lookup(self, name, cutoff=FUZZY_CUTOFF):
+        best = self.best(name, cutoff)
+        return best[1] if best else None
+
+    def best(self, name, cutoff=FUZZY_CUTOFF):
+        if not name or not self.names:
+            return None
+
+        lo = bisect_left(self.lengths, math.ceil(len(name) * cutoff / (2 - cutoff) - 1e-9))
+        hi = bisect_right(self.lengths, math.floor(len(name) * (2 - cutoff) / cutoff + 1e-9))
+        shared = defaultdict(int)
+        for gram in self.grams(name):
+            posting = self.postings.get(gram)
+            if posting:
+                for i in posting[bisect_left(posting, lo):bisect_left(posting, hi)]:
+                    shared[i] += 1
+
+        return self.confirm(name, heapq.nlargest(self.shortlist, shared, key=shared.get), cutoff)
+
+    def confirm(self, name, candidates, cutoff=FUZZY_CUTOFF):
+        matcher = SequenceMatcher()
+        matcher.set_seq2(name)
+        best = None
+        for i in candidates:
+            matcher.set_seq1(self.names[i])
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, self.names[i]) > best):
+                    best = (score, self.names[i])
+        return best
+
+    def build_vectors(self, dim=FUZZY_VECTOR_DIM):
+        self.dim = dim
+        self.vectors = self.encode(self.names)
+        self.length_array = np.array(self.lengths)
+        logger.info(f"Built {dim}-dim gram vectors for {len(self.names)} names ({self.vectors.nbytes // (1024 * 1024)} MB)")
+
+    def encode(self, names):
+        vectors = np.zeros((len(names), self.dim), dtype=np.float32)
+        for row, name in enumerate(names):
+            # crc32 rather than hash(): str hashes are salted per process, and the query
+            # vectors must land in the same buckets as the ones built for the names
+            for gram in self.grams(name):
+                vectors[row, zlib.crc32(gram.encode("utf-8", "surrogatepass")) % self.dim] += 1
+        # In place: a second N x dim float32 array would double the peak memory
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors
+
+    def best_many(self, names, cutoff=FUZZY_CUTOFF):
+        if self.vectors is None or not self.names:
+            return [self.best(name, cutoff) for name in names]
+
+        # Score names in chunks so each (chunk x candidates) block stays under FUZZY_VECTOR_CELLS
+        results = []
+        k = min(self.shortlist, len(self.names))
+        rows = max(1, FUZZY_VECTOR_CELLS // len(self.names))
+        for start in range(0, len(names), rows):
+            chunk = names[start:start + rows]
+            scores = self.encode(chunk) @ self.vectors.T
+            lengths = np.array([len(name) for name in chunk])[:, None]
+            lo = np.ceil(lengths * cutoff / (2 - cutoff) - 1e-9)
+            hi = np.floor(lengths * (2 - cutoff) / cutoff + 1e-9)
+            scores[(self.length_array < lo) | (self.length_array > hi)] = -1
+            top = np.argpartition(scores, -k, axis=1)[:, -k:]
+            for name, row, candidates in zip(chunk, scores, top):
+                results.append(self.confirm(name, [i for i in candidates if row[i] > 0], cutoff))
+        return results
+
+# === FUZZY MATCH POOL ===
+# Fuzzy scoring is pure Python, so threads serialize on the GIL. Forked workers inherit
+# the index built in the parent (it is never pickled); each task only carries a batch of
+# names and returns (name, match, score) for the ones that cleared the cutoff.
+match_index = None
+
+def match_batch(names):
+    results = []
+    for name, best in zip(names, match_index.best_many(names)):
+        if best:
+            results.append((name, best[1], best[0]))
+    return results
+
+class FuzzyMatchPool:
+    def __init__(self, fuzzy_index, processes=None, cache=None):
+        global match_index
+        match_index = fuzzy_index
+        self.cache = cache
+        self.processes = processes or os.cpu_count() or 1
+        self.pool = None
+        if self.processes > 1:
+            if "fork" in multiprocessing.get_all_start_methods():
+                self.pool = multiprocessing.get_context("fork").Pool(self.processes)
+                logger.info(f"Fuzzy matching with {self.processes} processes")
+            else:
+                logger.warning("fork is not available on this platform, fuzzy matching in-process")
+
+    # Returns {name: (match, score)} for the names that have a match
+    def match(self, names):
+        names = list(dict.fromkeys(name for name in names if name))
+        decisions = self.cache.get_many(names) if self.cache else {}
+        misses = [name for name in names if name not in decisions]
+        if self.pool is None or len(misses) < 2:
+            results = match_batch(misses)
+        else:
+            size = max(1, min(FUZZY_BATCH_SIZE, math.ceil(len(misses) / self.processes)))
+            batches = [misses[i:i + size] for i in range(0, len(misses), size)]
+            results = [result for batch in self.pool.map(match_batch, batches) for result in batch]
+        found = {name: (match, score) for name, match, score in results}
+        if self.cache:
+            self.cache.put_many({name: found.get(name, (None, None)) for name in misses})
+            logger.info(f"[FUZZY CACHE] {len(names) - len(misses)} cached, {len(misses)} scored")
+        decisions.update(found)
+        return {name: decision for name, decision in decisions.items() if decision[0]}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+# === FUZZY CACHE ===
+# Match decisions, including "no match", persist in the manifest DB per scope. The
+# version is a digest of the candidate names and match settings, so any change to the
+# key set (or the DB names, for sync) starts a new version and drops the old decisions.
+class FuzzyCache:
+    def __init__(self, scope, fuzzy_index, cutoff=FUZZY_CUTOFF):
+        digest = hashlib.sha1(f"{cutoff}|{fuzzy_index.shortlist}|{fuzzy_index.vectors is not None}".encode())
+        for name in sorted(fuzzy_index.names):
+            digest.update(name.encode("utf-8", "surrogatepass") + b"\0")
+        self.scope = scope
+        self.version = digest.hexdigest()
+        with manifest_lock:
+            dropped = manifest.execute(
+                "DELETE FROM fuzzy_cache WHERE scope = ? AND version != ?", (scope, self.version)
+            ).rowcount
+            manifest.commit()
+        if dropped:
+            logger.info(f"[FUZZY CACHE] Candidate set changed, dropped {dropped} {scope} decisions")
+
+    def get_many(self, names):
+        decisions = {}
+        with manifest_lock:
+            for i in range(0, len(names), 500):
+                batch = names[i:i + 500]
+                rows = manifest.execute(
+                    f"SELECT name, match, score FROM fuzzy_cache WHERE scope = ? AND name IN ({', '.join('?' * len(batch))})",
+                    (self.scope, *batch)
+                )
+                for name, match, score in rows:
+                    decisions[name] = (match, score)
+        return decisions
+
+    def put_many(self, decisions):
+        with manifest_lock:
+            manifest.executemany(
+                "INSERT OR REPLACE INTO fuzzy_cache (scope, name, version, match, score) VALUES (?, ?, ?, ?, ?)",
+                [(self.scope, name, self.version, match, score) for name, (match, score) in decisions.items()]
+            )
+            manifest.commit()
+
+# === MIGRATE FILES ===
+def migrate(args):
+    source_path = Path(SOURCE_DIR)
+    files = [f for f in source_path.iterdir() if f.is_file()]
+    logger.info(f"Starting migration of {len(files)} files")
+    for file_path in files:
+        s3_key = f"{TARGET_PREFIX}{file_path.name}"
+        etag = upload_file(str(file_path), s3_key)
+        if etag:
+            logger.info(f"Uploaded {file_path.name} to {s3_key} [ETag: {etag}]")
+    logger.info("Migration completed.")
+
+# === RECONCILE DB ===
+# Saved after every chunk commit, so the checkpoint never runs ahead of the DB. Unmatched
+# rows are appended to a sidecar CSV as they are found and only the small JSON state is
+# rewritten; rows past the saved id are dropped on load since the resumed scan redoes them.
+class ReconcileCheckpoint:
+    def __init__(self, resume=False):
+        self.last_id = None
+        self.updated = 0
+        self.unmatched = []
+        if resume:
+            self.load()
+        self.unmatched_file = open(CHECKPOINT_UNMATCHED, "w", newline='', encoding="utf-8")
+        self.writer = csv.DictWriter(self.unmatched_file, fieldnames=["id", "url", "expected_key"])
+        self.writer.writeheader()
+        self.writer.writerows(self.unmatched)
+
+    def load(self):
+        if not Path(CHECKPOINT_FILE).exists():
+            logger.warning(f"No checkpoint found at {CHECKPOINT_FILE}, starting from the first row")
+            return
+        with open(CHECKPOINT_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+        if state["table"] != TABLE_NAME:
+            raise SystemExit(f"Checkpoint {CHECKPOINT_FILE} belongs to table {state['table']}, not {TABLE_NAME}")
+        self.last_id = state["last_id"]
+        self.updated = state["updated"]
+        if self.last_id is not None and Path(CHECKPOINT_UNMATCHED).exists():
+            with open(CHECKPOINT_UNMATCHED, newline='', encoding="utf-8") as f:
+                self.unmatched = [
+                    dict(row, id=int(row["id"])) for row in csv.DictReader(f)
+                    if int(row["id"]) <= self.last_id
+                ]
+        logger.info(f"Resuming after id {self.last_id}: {self.updated} rows updated, {len(self.unmatched)} unmatched so far")
+
+    def add_unmatched(self, row):
+        self.writer.writerow(row)
+
+    def save(self, last_id, updated):
+        self.unmatched_file.flush()
+        os.fsync(self.unmatched_file.fileno())
+        tmp_path = f"{CHECKPOINT_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"table": TABLE_NAME, "last_id": last_id, "updated": updated}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CHECKPOINT_FILE)
+
+    def clear(self):
+        self.unmatched_file.close()
+        for path in (CHECKPOINT_FILE, CHECKPOINT_UNMATCHED):
+            Path(path).unlink(missing_ok=True)
+
+# Captured before each reconcile pass and saved once the pass finishes cleanly, so rows
+# added or changed while it ran are still picked up by the next --incremental run.
+def current_watermark(updated_column=None):
+    columns = "MAX(id) AS last_id" + (f", MAX({updated_column}) AS updated_at" if updated_column else "")
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT {columns} FROM {TABLE_NAME}")
+        state = cursor.fetchone()
+    return {
+        "table": TABLE_NAME,
+        "last_id": state["last_id"],
+        "updated_column": updated_column,
+        "updated_at": str(state["updated_at"]) if state.get("updated_at") is not None else None
+    }
+
+def load_watermark():
+    if not Path(WATERMARK_FILE).exists():
+        return None
+    with open(WATERMARK_FILE, encoding="utf-8") as f:
+        watermark = json.load(f)
+    if watermark["table"] != TABLE_NAME:
+        logger.warning(f"Watermark {WATERMARK_FILE} belongs to table {watermark['table']}, ignoring it")
+        return None
+    return watermark
+
+def save_watermark(watermark):
+    tmp_path = f"{WATERMARK_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(watermark, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, WATERMARK_FILE)
+    logger.info(f"Saved reconcile watermark at id {watermark['last_id']} to {WATERMARK_FILE}")
+
+# Rows still pointing at the legacy server or missing an hcp_id, plus anything added
+# (or, with an updated column, modified) since the stored watermark.
+def incremental_filter(watermark, updated_column=None):
+    conditions = ["url LIKE %s", "url LIKE %s", "hcp_id IS NULL"]
+    params = list(LEGACY_URL_PATTERNS)
+    if watermark and watermark["last_id"] is not None:
+        conditions.append("id > %s")
+        params.append(watermark["last_id"])
+    if updated_column and watermark and watermark.get("updated_column") == updated_column and watermark["updated_at"]:
+        conditions.append(f"{updated_column} > %s")
+        params.append(watermark["updated_at"])
+    if watermark:
+        logger.info(f"Incremental reconcile since id {watermark['last_id']} ({updated_column or 'no updated column'})")
+    else:
+        logger.warning(f"No watermark in {WATERMARK_FILE}, selecting legacy and unreconciled rows only")
+    return f"({' OR '.join(conditions)})", tuple(params)
+
+def split_id_ranges(parts):
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(id) AS lo, MAX(id) AS hi FROM {TABLE_NAME}")
+        bounds = cursor.fetchone()
+    if bounds["lo"] is None:
+        return []
+    lo, hi = bounds["lo"], bounds["hi"]
+    span = (hi - lo) // parts + 1
+    return [(start, min(start + span - 1, hi)) for start in range(lo, hi + 1, span)]
+
+# Yields (db_rows, range) blocks of at most `size` rows. A loaded DbRows is sliced in
+# place and streamed rows are packed into one DbRows per block, so reconcile reads ids
+# and names from the columnar arrays and only decodes the URL of an unmatched row.
+def row_blocks(rows, size=FUZZY_BLOCK_ROWS):
+    if isinstance(rows, DbRows):
+        for start in range(0, len(rows), size):
+            yield rows, range(start, min(start + size, len(rows)))
+        return
+    rows = iter(rows)
+    while True:
+        block = DbRows.load(itertools.islice(rows, size))
+        if not len(block):
+            return
+        yield block, range(len(block))
+
+def reconcile_rows(args, conn, s3_index, matcher, filters=(), label="reconcile", checkpoint=None):
+    updated = checkpoint.updated if checkpoint else 0
+    unmatched = list(checkpoint.unmatched) if checkpoint else []
+    matched_keys = []
+    staged = []
+    last_id = None
+    filters = list(filters)
+    if checkpoint and checkpoint.last_id is not None:
+        filters.append(("id > %s", (checkpoint.last_id,)))
+    where = f" WHERE {' AND '.join(sql for sql, _ in filters)}" if filters else ""
+    params = tuple(param for _, filter_params in filters for param in filter_params) or None
+    sql = f"SELECT id, url FROM {TABLE_NAME}{where} ORDER BY id"
+    if args.stream:
+        rows = stream_rows(sql, params, args.fetch_size)
+    else:
+        rows = load_db_rows(sql, params, args.fetch_size, conn)
+    with conn.cursor() as cursor:
+        def flush_staging():
+            if staged:
+                stage_rows(cursor, staged)
+                staged.clear()
+            merged = merge_staging(cursor)
+            logger.info(f"Merged {merged} rows from {STAGING_TABLE} into {TABLE_NAME}")
+
+        committer = ChunkedCommitter(
+            conn, label, args.commit_rows, args.commit_seconds,
+            before_commit=flush_staging if args.bulk_merge else None,
+            after_commit=(lambda: checkpoint.save(last_id, updated)) if checkpoint else None
+        )
+        if args.bulk_merge:
+            create_staging_table(cursor)
+        # Names without an exact key are fuzzy matched a block at a time, so the
+        # matcher can spread each block across its worker processes
+        for db_rows, block in row_blocks(rows):
+            filenames = [db_rows.legacy_name(i) for i in block]
+            fuzzy_matches = matcher.match(
+                filename for filename in filenames
+                if filename and not index_etag(s3_index, f"{TARGET_PREFIX}{filename}")
+            )
+            for i, filename in zip(block, filenames):
+                row_id = db_rows.ids[i]
+                last_id = row_id
+                if not filename:
+                    continue
+                s3_key = f"{TARGET_PREFIX}{filename}"
+                etag = index_etag(s3_index, s3_key)
+                if not etag and filename in fuzzy_matches:
+                    s3_key = f"{TARGET_PREFIX}{fuzzy_matches[filename][0]}"
+                    etag = index_etag(s3_index, s3_key)
+                if etag:
+                    matched_keys.append(s3_key)
+                    new_url = f"{ENDPOINT_URL.rstrip('/')}/{s3_key}"
+                    if args.bulk_merge:
+                        staged.append((row_id, etag, s3_key, new_url, *norm_values(new_url, s3_key, conn)))
+                        if len(staged) >= STAGING_BATCH_SIZE:
+                            stage_rows(cursor, staged)
+                            staged.clear()
+                    else:
+                        norm_sql, norm_params = norm_assignments(new_url, s3_key, conn)
+                        cursor.execute(
+                            f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s, url = %s{norm_sql} WHERE id = %s",
+                            (etag, s3_key, new_url, *norm_params, row_id)
+                        )
+                    updated += 1
+                    committer.tick()
+                else:
+                    unmatched.append({"id": row_id, "url": db_rows.url(i), "expected_key": s3_key})
+                    if checkpoint:
+                        checkpoint.add_unmatched(unmatched[-1])
+        committer.finish()
+
+    return updated, unmatched, matched_keys
+
+# Each range gets its own connection (and so its own staging table); the listing and
+# fuzzy matcher are only read, so all workers share them. The worker threads only wait
+# on MySQL and do dict lookups into the listing: the CPU-bound fuzzy scoring is handed
+# to the matcher's fork pool, so --workers scales DB I/O and --match-processes scales
+# matching. With --match-processes 1 the scoring runs in these threads under the GIL.
+def reconcile_id_range(args, s3_index, matcher, id_range, filters=()):
+    conn = connect_db()
+    try:
+        return reconcile_rows(
+            args, conn, s3_index, matcher, [("id BETWEEN %s AND %s", id_range), *filters],
+            label=f"reconcile {id_range[0]}-{id_range[1]}"
+        )
+    finally:
+        conn.close()
+
+def reconcile_all(args, s3_index, matcher, filters=()):
+    failed_ranges = []
+    if args.workers > 1:
+        updated = 0
+        unmatched = []
+        matched_keys = []
+        ranges = split_id_ranges(args.workers * RANGES_PER_WORKER)
+        logger.info(f"Reconciling {len(ranges)} id ranges with {args.workers} workers")
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(reconcile_id_range, args, s3_index, matcher, r, filters): r for r in ranges}
+            for future in as_completed(futures):
+                id_range = futures[future]
+                try:
+                    range_updated, range_unmatched, range_matched = future.result()
+                except Exception as e:
+                    logger.error(f"[RANGE] ids {id_range[0]}-{id_range[1]} failed → {e}")
+                    failed_ranges.append(id_range)
+                    continue
+                updated += range_updated
+                unmatched.extend(range_unmatched)
+                matched_keys.extend(range_matched)
+                logger.info(f"[RANGE] ids {id_range[0]}-{id_range[1]}: {range_updated} updated, {len(range_unmatched)} unmatched")
+        unmatched.sort(key=lambda row: row["id"])
+        if failed_ranges:
+            logger.warning(f"{len(failed_ranges)} id ranges failed and need a rerun: {sorted(failed_ranges)}")
+    else:
+        checkpoint = ReconcileCheckpoint(resume=args.resume)
+        updated, unmatched, matched_keys = reconcile_rows(args, db, s3_index, matcher, filters, checkpoint=checkpoint)
+        checkpoint.clear()
+    return updated, unmatched, matched_keys, failed_ranges
+
+# Exact matches for legacy rows as chunked UPDATE ... JOIN between filename_norm and the
+# staged listing. Rows it leaves legacy (fuzzy candidates and misses) are then picked up
+# by the normal reconcile pass, which also covers anything the join could not see.
+def reconcile_sql_join(args, s3_index, filters=()):
+    updated = 0
+    matched_keys = []
+    conditions = ["t.id BETWEEN %s AND %s", "(t.url LIKE %s OR t.url LIKE %s)", *(sql for sql, _ in filters)]
+    filter_params = tuple(param for _, params in filters for param in params)
+    join = f"{TABLE_NAME} t JOIN {KEYS_TABLE} k ON t.filename_norm = k.key_name"
+    where = f"WHERE {' AND '.join(conditions)}"
+    assignments = (
+        "t.hcp_id = k.etag, t.path = k.s3_key, t.url = CONCAT(%s, k.s3_key), "
+        "t.filename_norm = k.key_filename_norm, t.path_norm = k.key_path_norm"
+    )
+    committer = ChunkedCommitter(db, "reconcile sql-join", args.commit_rows, args.commit_seconds)
+    with db.cursor() as cursor:
+        create_keys_table(cursor)
+        stage_keys(cursor, (
+            (key, etag, size, key[len(TARGET_PREFIX):]) for key, (etag, size, _) in s3_index.items()
+        ))
+        for id_range in id_chunks(SQL_JOIN_CHUNK_IDS):
+            params = (*id_range, *LEGACY_URL_PATTERNS, *filter_params)
+            if args.verify_head:
+                cursor.execute(f"SELECT k.s3_key FROM {join} {where}", params)
+                matched_keys.extend(row["s3_key"] for row in cursor.fetchall())
+            cursor.execute(f"UPDATE {join} SET {assignments} {where}", (f"{ENDPOINT_URL.rstrip('/')}/", *params))
+            updated += cursor.rowcount
+            committer.tick(cursor.rowcount)
+        committer.finish()
+    logger.info(f"Matched {updated} rows exactly with indexed joins")
+    return updated, matched_keys
+
+def reconcile(args):
+    s3_index = get_s3_index(TARGET_PREFIX, not args.trust_manifest)
+    fuzzy_index = FuzzyIndex(s3_index.iter_names())
+    if args.vector_match:
+        fuzzy_index.build_vectors()
+    cache = None if args.no_fuzzy_cache else FuzzyCache("reconcile", fuzzy_index)
+    # Fork the match processes before any worker threads start
+    matcher = FuzzyMatchPool(fuzzy_index, args.match_processes, cache)
+    watermark = current_watermark(args.updated_column)
+    filters = [incremental_filter(load_watermark(), args.updated_column)] if args.incremental else []
+    try:
+        joined, joined_keys = 0, []
+        if args.sql_join:
+            joined, joined_keys = reconcile_sql_join(args, s3_index, filters)
+            # Only rows left on a legacy URL still need the Python pass (fuzzy matching)
+            filters = [*filters, ("(url LIKE %s OR url LIKE %s)", LEGACY_URL_PATTERNS)]
+        updated, unmatched, matched_keys, failed_ranges = reconcile_all(args, s3_index, matcher, filters)
+    finally:
+        matcher.close()
+    updated += joined
+    matched_keys.extend(joined_keys)
+    if not failed_ranges:
+        save_watermark(watermark)
+
+    with open(UNMATCHED_OUTPUT, "w", newline='', encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=["id", "url", "expected_key"])
+        writer.writeheader()
+        for row in unmatched:
+            writer.writerow(row)
+
+    if args.verify_head and matched_keys:
+        verify_index_sample(s3_index, matched_keys, args.verify_head)
+
+    logger.info(f"Reconciled {updated} rows. Unmatched written to {UNMATCHED_OUTPUT}")
+
+# === FIND ORPHANS ===
+def orphan_match_key(key):
+    return normalize_filename(key.lower()) or ""
+
+# Tracked objects sharing one of `etags`, as {etag: [(path, size)]}. The size comes from
+# the manifest and is None when the tracked key is not in it.
+def tracked_copies(etags):
+    if not etags:
+        return {}
+    etags = list(etags)
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT hcp_id, path FROM {TABLE_NAME} WHERE hcp_id IN ({', '.join(['%s'] * len(etags))}) AND path IS NOT NULL", etags
+        )
+        rows = cursor.fetchall()
+    paths = [row["path"] for row in rows]
+    sizes = {}
+    with manifest_lock:
+        # One ETag can be shared by any number of tracked paths, so the lookup is batched
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            sizes.update(manifest.execute(
+                f"SELECT key, size FROM objects WHERE key IN ({', '.join('?' * len(batch))})", batch
+            ))
+    copies = defaultdict(list)
+    for row in rows:
+        copies[row["hcp_id"]].append((row["path"], sizes.get(row["path"])))
+    return copies
+
+# Writes ORPHAN_CSV in batches so each batch's ETags are joined against the tracked
+# objects' hcp_id in one query. A byte-identical copy (same ETag, and same size where the
+# manifest knows the tracked size) is classified "duplicate of <path>", else "unique".
+class OrphanWriter:
+    def __init__(self):
+        with db.cursor() as cursor:
+            cursor.execute(f"SHOW INDEX FROM {TABLE_NAME} WHERE Column_name = 'hcp_id' AND Seq_in_index = 1")
+            if not cursor.fetchall():
+                logger.warning(
+                    f"{TABLE_NAME}.hcp_id has no index, every batch of orphans scans the table to find tracked copies. "
+                    f"Add one with: ALTER TABLE {TABLE_NAME} ADD INDEX idx_hcp_id (hcp_id)"
+                )
+        self.file = open(ORPHAN_CSV, "w", newline='', encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["orphaned_s3_key", "etag", "size", "classification"])
+        self.pending = []
+        self.orphaned = 0
+        self.duplicates = 0
+
+    def add(self, key, etag, size):
+        self.pending.append((key, etag, int(size) if size not in (None, "") else None))
+        if len(self.pending) >= ORPHAN_CLASSIFY_BATCH:
+            self.flush()
+
+    def flush(self):
+        copies = tracked_copies({etag for _, etag, _ in self.pending if etag})
+        for key, etag, size in self.pending:
+            same = [path for path, tracked_size in copies.get(etag, []) if tracked_size in (None, size)]
+            if same:
+                self.duplicates += 1
+            self.writer.writerow([key, etag, size, f"duplicate of {same[0]}" if same else "unique"])
+        self.orphaned += len(self.pending)
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        logger.info(f"Found {self.orphaned} orphaned S3 files ({self.duplicates} duplicates of tracked objects). Wrote to {ORPHAN_CSV}")
+
+# Neither stream is ordered on the comparison key itself (lower-case + NFC differs from
+# S3's byte order and from any MySQL collation), so each side goes through a bounded
+# external sort: runs of SORT_RUN_SIZE tuples are sorted in memory, spilled to temp files
+# and lazily merged. The DB paths are therefore read unordered, sparing MySQL a
+# server-side sort of the whole table that would be thrown away.
+def external_sort(items, run_size=SORT_RUN_SIZE):
+    items = iter(items)
+    runs = []
+    try:
+        while True:
+            run = sorted(itertools.islice(items, run_size))
+            if not run:
+                break
+            if not runs and len(run) < run_size:
+                yield from run
+                return
+            f = tempfile.TemporaryFile("w+", encoding="utf-8", errors="surrogatepass", newline="")
+            csv.writer(f).writerows(run)
+            f.seek(0)
+            runs.append(f)
+        if len(runs) > 1:
+            logger.info(f"Merging {len(runs)} sorted runs of up to {run_size} keys")
+        yield from heapq.merge(*(map(tuple, csv.reader(f)) for f in runs))
+    finally:
+        for f in runs:
+            f.close()
+
+def find_orphans_merge(args):
+    db_keys = external_sort(
+        (orphan_match_key(row["path"]),)
+        for row in stream_rows(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL", fetch_size=args.fetch_size)
+    )
+    s3_objects = external_sort(
+        (orphan_match_key(key), key, etag, size) for key, etag, size in iter_s3_objects(TARGET_PREFIX, not args.trust_manifest)
+    )
+
+    scanned = 0
+    db_key = next(db_keys, None)
+    orphans = OrphanWriter()
+    try:
+        for match_key, key, etag, size in s3_objects:
+            scanned += 1
+            while db_key is not None and db_key[0] < match_key:
+                db_key = next(db_keys, None)
+            if db_key is None or db_key[0] != match_key:
+                orphans.add(key, etag, size)
+    finally:
+        orphans.close()
+    logger.info(f"Merge-joined {scanned} S3 keys")
+
+# Bit-array Bloom filter sized for `capacity` items at `error_rate` false positives, using
+# double hashing over one blake2b digest. "Not in filter" is exact, so only maybe-present
+# keys need an exact check.
+class BloomFilter:
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for p in self.positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+# Exact lookup for a batch of keys, returning the normalized keys found. With the
+# normalized columns usable this is one indexed IN on path_norm, the same key the Bloom
+# filter is built from. Otherwise the IN list carries the raw, lower-case, NFC and NFD
+# spellings so the path index is still used; a key that misses can still be tracked under
+# a spelling those forms don't cover (percent-encoded, padded, another case under a
+# binary collation), so callers settle the misses with resolve_suspects().
+def db_paths_present(keys, use_norm=False):
+    if use_norm:
+        norms = list({orphan_match_key(key) for key in keys})
+        with db.cursor() as cursor:
+            cursor.execute(
+                f"SELECT path_norm FROM {TABLE_NAME} WHERE path_norm IN ({', '.join(['%s'] * len(norms))})", norms
+            )
+            return {row["path_norm"] for row in cursor.fetchall()}
+    variants = set()
+    for key in keys:
+        for form in (key, key.lower()):
+            variants.update((form, unicodedata.normalize("NFC", form), unicodedata.normalize("NFD", form)))
+    variants = list(variants)
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT path FROM {TABLE_NAME} WHERE path IN ({', '.join(['%s'] * len(variants))})", variants
+        )
+        return {orphan_match_key(row["path"]) for row in cursor.fetchall()}
+
+# Normalized keys of `suspects` that some DB path in `paths` normalizes to, settling in
+# one pass every Bloom positive the indexed lookup could not confirm.
+def resolve_suspects(suspects, paths):
+    wanted = {orphan_match_key(key) for key in suspects}
+    return {match for match in map(orphan_match_key, paths) if match in wanted}
+
+def find_orphans_bloom(args):
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) AS paths FROM {TABLE_NAME} WHERE path IS NOT NULL")
+        count = cursor.fetchone()["paths"]
+    bloom = BloomFilter(count, args.bloom_error_rate)
+    for row in stream_rows(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL", fetch_size=args.fetch_size):
+        bloom.add(orphan_match_key(row["path"]))
+    logger.info(f"Built Bloom filter over {count} DB paths: {len(bloom.bits) / (1024 * 1024):.1f} MB, {bloom.hashes} hashes")
+
+    confirmed = 0
+    maybe_present = []
+    suspects = []
+    use_norm = norm_columns_usable()
+    orphans = OrphanWriter()
+
+    def confirm():
+        nonlocal confirmed
+        present = db_paths_present([key for key, _, _ in maybe_present], use_norm)
+        for key, etag, size in maybe_present:
+            if orphan_match_key(key) in present:
+                confirmed += 1
+            elif use_norm:
+                orphans.add(key, etag, size)
+            else:
+                suspects.append((key, etag, size))
+        maybe_present.clear()
+
+    try:
+        for key, etag, size in iter_s3_objects(TARGET_PREFIX, not args.trust_manifest):
+            if orphan_match_key(key) in bloom:
+                maybe_present.append((key, etag, size))
+                if len(maybe_present) >= BLOOM_CONFIRM_BATCH:
+                    confirm()
+            else:
+                orphans.add(key, etag, size)
+        if maybe_present:
+            confirm()
+        if suspects:
+            logger.info(f"Re-checking {len(suspects)} unconfirmed Bloom hits against every DB path")
+            present = resolve_suspects(
+                (key for key, _, _ in suspects),
+                (row["path"] for row in stream_rows(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL", fetch_size=args.fetch_size))
+            )
+            for key, etag, size in suspects:
+                if orphan_match_key(key) in present:
+                    confirmed += 1
+                else:
+                    orphans.add(key, etag, size)
+    finally:
+        orphans.close()
+    logger.info(f"Bloom filter confirmed {confirmed} tracked keys with DB lookups")
+
+# Anti-join of the staged listing against the path_norm index; only the orphans come back.
+def find_orphans_sql(args):
+    with db.cursor() as cursor:
+        create_keys_table(cursor)
+        stage_keys(cursor, (
+            (key, etag, size, None) for key, etag, size in iter_s3_objects(TARGET_PREFIX, not args.trust_manifest)
+        ))
+        cursor.execute(
+            f"SELECT k.s3_key, k.etag, k.size FROM {KEYS_TABLE} k WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {TABLE_NAME} t WHERE t.path_norm = k.key_path_norm) ORDER BY k.s3_key"
+        )
+        rows = cursor.fetchall()
+    orphans = OrphanWriter()
+    try:
+        for row in rows:
+            orphans.add(row["s3_key"], row["etag"], row["size"])
+    finally:
+        orphans.close()
+
+def find_orphans(args):
+    if args.sql_join:
+        return find_orphans_sql(args)
+    if args.merge:
+        return find_orphans_merge(args)
+    if args.bloom:
+        return find_orphans_bloom(args)
+    # DB paths are looked up in the key store's folded index as they arrive and only a
+    # tracked flag per key is kept, instead of a set of every normalized DB path
+    s3_index = get_s3_index(TARGET_PREFIX, not args.trust_manifest)
+    tracked = bytearray(len(s3_index))
+    for row in fetch_rows(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL", stream=args.stream, fetch_size=args.fetch_size):
+        for i in s3_index.find_folded(row["path"]):
+            tracked[i] = 1
+
+    orphans = OrphanWriter()
+    try:
+        for i in range(len(s3_index)):
+            if not tracked[i]:
+                etag, size, _ = s3_index.entry(i)
+                orphans.add(s3_index.key(i), etag, size)
+    finally:
+        orphans.close()
+
+# === IMPORT ORPHANS ===
+# Copies byte ranges of `key` in parallel with upload_part_copy. Needed above the 5 GB
+# single-copy limit and much faster for large objects; the upload is aborted on any error.
+# Unlike copy_object, a multipart upload starts without the source's headers, so they are
+# read with a HEAD and passed on.
+def multipart_copy(key, new_key, size, part_workers=MULTIPART_PART_WORKERS):
+    head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+    size = head["ContentLength"]
+    headers = {name: head[name] for name in MULTIPART_COPY_HEADERS if head.get(name)}
+    part_size = max(MULTIPART_PART_SIZE, math.ceil(size / MULTIPART_MAX_PARTS))
+    ranges = [
+        (number, start, min(start + part_size, size) - 1)
+        for number, start in enumerate(range(0, size, part_size), start=1)
+    ]
+    upload_id = s3.create_multipart_upload(Bucket=BUCKET_NAME, Key=new_key, **headers)["UploadId"]
+
+    def copy_part(part):
+        number, first, last = part
+        response = s3.upload_part_copy(
+            Bucket=BUCKET_NAME,
+            Key=new_key,
+            UploadId=upload_id,
+            PartNumber=number,
+            CopySource={'Bucket': BUCKET_NAME, 'Key': key},
+            CopySourceRange=f"bytes={first}-{last}"
+        )
+        return {"PartNumber": number, "ETag": response["CopyPartResult"]["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=part_workers) as executor:
+            parts = list(executor.map(copy_part, ranges))
+        completed = s3.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=new_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=new_key, UploadId=upload_id)
+        raise
+    logger.info(f"[MULTIPART] {key} → {new_key} in {len(parts)} parts ({size / (1024 ** 3):.2f} GB)")
+    return completed.get("ETag", "").strip('"'), None
+
+# The copy response already carries the new ETag, so no follow-up HEAD is needed. Sizes
+# come from the orphan CSV; objects over MULTIPART_COPY_THRESHOLD are copied in parts.
+def copy_object(key, new_key, size=None, part_workers=MULTIPART_PART_WORKERS):
+    if size and size > MULTIPART_COPY_THRESHOLD:
+        return multipart_copy(key, new_key, size, part_workers)
+    copied = s3.copy_object(
+        Bucket=BUCKET_NAME,
+        CopySource={'Bucket': BUCKET_NAME, 'Key': key},
+        Key=new_key
+    )
+    result = copied.get("CopyObjectResult", {})
+    return result.get("ETag", "").strip('"'), result.get("LastModified")
+
+# delete_objects takes up to 1000 keys per call and reports failures per key; returns
+# {key: error} for every key that was not deleted
+def delete_keys(keys):
+    failed = {}
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        try:
+            response = s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+        except Exception as e:
+            failed.update((key, str(e)) for key in batch)
+            continue
+        for error in response.get("Errors", []):
+            failed[error["Key"]] = f"{error.get('Code')}: {error.get('Message')}"
+    return failed
+
+# Buffers imported rows and writes them as multi-row INSERT ... ON DUPLICATE KEY UPDATE
+# statements (pymysql folds executemany into one statement per batch). With a unique key
+# on path, re-running after a partial failure updates the rows it already wrote instead
+# of inserting them twice.
+class ImportWriter:
+    def __init__(self, conn, committer, batch_size=INSERT_BATCH_SIZE):
+        self.conn = conn
+        self.committer = committer
+        self.batch_size = batch_size
+        self.pending = []
+        self.inserted = []
+        self.failed = []
+        with conn.cursor() as cursor:
+            cursor.execute(f"SHOW INDEX FROM {TABLE_NAME} WHERE Column_name = 'path' AND Non_unique = 0")
+            if not cursor.fetchall():
+                logger.warning(
+                    f"{TABLE_NAME}.path has no unique key, re-runs can insert duplicates. "
+                    f"Add one with: ALTER TABLE {TABLE_NAME} ADD UNIQUE KEY uniq_path (path)"
+                )
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            norm_columns = NORM_COLUMNS if has_norm_columns(self.conn) else ()
+            columns = ("name", "url", "path", "hcp_id", *norm_columns)
+            updates = ("name", "url", "hcp_id", *norm_columns)
+            with self.conn.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {TABLE_NAME} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                    f"ON DUPLICATE KEY UPDATE {', '.join(f'{column} = VALUES({column})' for column in updates)}",
+                    [
+                        (row["name"], row["url"], row["path"], row["hcp_id"], *norm_values(row["url"], row["path"], self.conn))
+                        for row in self.pending
+                    ]
+                )
+            self.inserted.extend(self.pending)
+            self.committer.tick(len(self.pending))
+        except Exception as e:
+            logger.error(f"Failed to write {len(self.pending)} imported orphans → {e}")
+            self.failed.extend(self.pending)
+        self.pending = []
+
+def import_orphans(args):
+    orphans = []
+    skipped = 0
+    with open(ORPHAN_CSV, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            if row.get("classification", "unique").startswith("duplicate of"):
+                logger.info(f"[SKIP] {row['orphaned_s3_key']} is a {row['classification']}")
+                skipped += 1
+                continue
+            # The key is copied and deleted as listed: normalize_filename() would unquote
+            # a literal %XX and strip spaces, naming an object that does not exist
+            orphans.append((unicodedata.normalize("NFC", row["orphaned_s3_key"]), int(row["size"]) if row.get("size") else None))
+
+    failed = []
+    copied = []
+    # Orphans in different folders can share a basename and so a target key. Their copies
+    # would race, the upsert would fold them into one row and both sources would be
+    # deleted, so only the first orphan per target is imported and the rest are reported.
+    targets = {}
+    for key, size in orphans:
+        new_key = f"{TARGET_PREFIX}orphan/{key.split('/')[-1]}"
+        if new_key in targets:
+            logger.error(f"[COLLISION] {key} would also move to {new_key} (from {targets[new_key][0]}), skipping it")
+            failed.append({"key": key, "stage": "collision", "error": f"{new_key} is already the target of {targets[new_key][0]}"})
+        else:
+            targets[new_key] = (key, size)
+    committer = ChunkedCommitter(db, "import-orphans", args.commit_rows, args.commit_seconds)
+    writer = ImportWriter(db, committer, args.insert_batch)
+
+    # Each batch's rows are inserted and committed before any source is deleted, so a
+    # failed insert or commit leaves the source in place instead of removing an object
+    # the DB never recorded. A source whose delete fails keeps its tracked copy, so the
+    # next find-orphans reports it as a duplicate.
+    def flush():
+        for _, entry in copied:
+            writer.add(entry)
+        writer.flush()
+        batch = {id(entry) for _, entry in copied}
+        try:
+            committer.commit()
+        except Exception as e:
+            logger.error(f"Failed to commit {len(copied)} imported orphans, keeping their sources → {e}")
+            db.rollback()
+            writer.inserted = [row for row in writer.inserted if id(row) not in batch]
+            failed.extend({"key": key, "stage": "commit", "error": str(e)} for key, _ in copied)
+            copied.clear()
+            return
+        not_written = {id(row) for row in writer.failed}
+        written = [key for key, entry in copied if id(entry) not in not_written]
+        delete_failed = delete_keys(written)
+        for key in written:
+            if key in delete_failed:
+                logger.error(f"Failed to delete orphan source: {key} → {delete_failed[key]}")
+                failed.append({"key": key, "stage": "delete", "error": delete_failed[key]})
+            else:
+                manifest_delete(key)
+        copied.clear()
+
+    # Copies and their part copies share the client's S3_MAX_CONNECTIONS pool
+    part_workers = max(1, min(MULTIPART_PART_WORKERS, S3_MAX_CONNECTIONS // max(args.workers, 1)))
+    logger.info(f"Importing {len(targets)} orphans with {args.workers} copy workers, {part_workers} part workers each")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for new_key, (key, size) in targets.items():
+            filename = key.split("/")[-1]
+            futures[executor.submit(copy_object, key, new_key, size, part_workers)] = (key, filename, new_key, size)
+        for future in as_completed(futures):
+            key, filename, new_key, size = futures[future]
+            try:
+                etag, last_modified = future.result()
+            except Exception as e:
+                logger.error(f"Failed to import orphan: {key} → {e}")
+                failed.append({"key": key, "stage": "copy", "error": str(e)})
+                continue
+            manifest_put(new_key, etag, size, last_modified)
+            new_url = f"{ENDPOINT_URL.rstrip('/')}/{new_key}"
+            copied.append((key, {"name": filename, "path": new_key, "url": new_url, "hcp_id": etag}))
+            if len(copied) >= DELETE_BATCH_SIZE:
+                flush()
+    if copied:
+        flush()
+    committer.finish()
+    failed.extend({"key": row["path"], "stage": "insert", "error": "batch insert failed"} for row in writer.failed)
+    inserted = writer.inserted
+
+    with open(INSERT_LOG_CSV, "w", newline='', encoding="utf-8") as out:
+        log_writer = csv.DictWriter(out, fieldnames=["name", "path", "url", "hcp_id"])
+        log_writer.writeheader()
+        for row in inserted:
+            log_writer.writerow(row)
+
+    if failed:
+        with open(IMPORT_FAILED_CSV, "w", newline='', encoding="utf-8") as out:
+            writer = csv.DictWriter(out, fieldnames=["key", "stage", "error"])
+            writer.writeheader()
+            writer.writerows(failed)
+        logger.warning(f"{len(failed)} orphans failed, see {IMPORT_FAILED_CSV}")
+
+    logger.info(f"Imported {len(inserted)} orphaned files, skipped {skipped} duplicates. Log written to {INSERT_LOG_CSV}")
+
 # === SYNC ===
 def sync(args):
     source_path = Path(SOURCE_DIR)
@@ -431,7 +2341,39 @@ def sync(args):
     total = len(files)
     logger.info(f"Starting sync of {total} files using {args.workers} threads. Dry run: {args.dry_run}")
 
-    db_urls = get_db_urls()
+    s3_index = get_s3_index(TARGET_PREFIX, not args.trust_manifest)
+    upload_names = [normalize_filename(f.name) for f in files if not index_etag(s3_index, f"{TARGET_PREFIX}{f.name}")]
+    if args.sql_join:
+        # Exact rows come from an indexed join; the fuzzy index only needs the distinct
+        # names, read off the filename_norm index, and only if something is left to match
+        db_rows = join_db_rows(upload_names)
+        if any(name not in db_rows.by_name() for name in upload_names):
+            with db.cursor() as cursor:
+                cursor.execute(f"SELECT DISTINCT filename_norm FROM {TABLE_NAME} WHERE filename_norm <> ''")
+                fuzzy_index = FuzzyIndex(row["filename_norm"] for row in cursor.fetchall())
+        else:
+            fuzzy_index = None
+    else:
+        # Only rows named like an upload are kept, plus the distinct names for the fuzzy
+        # index; rows for fuzzy winners are picked up by a second scan below
+        db_rows, db_names = scan_db_rows(upload_names, args.stream, args.fetch_size, collect_names=True)
+        fuzzy_index = FuzzyIndex(db_names) if any(name not in db_rows.by_name() for name in upload_names) else None
+        del db_names
+    fuzzy_matches = {}
+    if fuzzy_index:
+        # Only files that will be uploaded and have no exact DB row reach fuzzy matching, so
+        # match them up front in the process pool instead of on the GIL-bound upload threads
+        cache = None if args.no_fuzzy_cache else FuzzyCache("sync", fuzzy_index)
+        matcher = FuzzyMatchPool(fuzzy_index, args.match_processes, cache)
+        try:
+            fuzzy_matches = matcher.match(name for name in upload_names if name not in db_rows.by_name())
+        finally:
+            matcher.close()
+    winners = {match for match, _ in fuzzy_matches.values() if match not in db_rows.by_name()}
+    if winners and args.sql_join:
+        join_db_rows(winners, db_rows)
+    elif winners:
+        scan_db_rows(winners, args.stream, args.fetch_size, db_rows)
     results = {
         "uploaded": 0,
         "skipped": 0,
@@ -440,6 +2382,9 @@ def sync(args):
         "missing_db": 0,
         "fuzzy_match": 0
     }
+    # worker threads share `db`, so DB writes and commits go through one lock
+    db_lock = threading.Lock()
+    committer = ChunkedCommitter(db, "sync", args.commit_rows, args.commit_seconds)
 
     def process_file(file_path):
         s3_key = f"{TARGET_PREFIX}{file_path.name}"
@@ -447,7 +2392,7 @@ def sync(args):
         clean_path = f"{TARGET_PREFIX}{filename}"
 
         try:
-            etag = s3_object_exists(s3_key)
+            etag = index_etag(s3_index, s3_key)
             if etag:
                 logger.info(f"[SKIP] {filename} already exists in S3")
                 return ("skipped", filename)
@@ -462,20 +2407,22 @@ def sync(args):
 
             logger.info(f"[UPLOAD] {filename} → {s3_key} [ETag: {etag}]")
 
-            match = next((row for row in db_urls if normalize_filename(row["url"].split("/")[-1]) == normalize_filename(filename)), None)
+            match = db_rows.find(normalize_filename(filename))
 
             used_fuzzy = False
             if not match:
-                match = find_best_match(filename, db_urls)
+                match = find_best_match(filename, db_rows, fuzzy_matches)
                 used_fuzzy = True
 
             if match:
                 if not args.dry_run:
-                    with db.cursor() as cursor:
+                    with db_lock, db.cursor() as cursor:
+                        norm_sql, norm_params = norm_assignments(filename, clean_path)
                         cursor.execute(
-                            f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s, url = %s WHERE id = %s",
-                            (etag, clean_path, filename, match["id"])
+                            f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s, url = %s{norm_sql} WHERE id = %s",
+                            (etag, clean_path, filename, *norm_params, match["id"])
                         )
+                        committer.tick()
                 logger.info(f"[DB] Updated ID {match['id']} for {filename} {'(fuzzy match)' if used_fuzzy else ''}")
                 return ("fuzzy_match" if used_fuzzy else "updated", filename)
             else:
@@ -493,7 +2440,7 @@ def sync(args):
             results[result_type] += 1
 
     if not args.dry_run:
-        db.commit()
+        committer.finish()
 
     logger.info("=== SYNC SUMMARY ===")
     for k, v in results.items():
@@ -505,15 +2452,63 @@ if __name__ == "__main__":
     sub = parser.add_subparsers(dest="command")
 
     sub.add_parser("migrate", help="Upload all files from source directory to S3")
-    sub.add_parser("reconcile-db", help="Update DB with hcp_id/path from existing S3 files")
-    sub.add_parser("find-orphans", help="Find S3 files not tracked in DB")
-    sub.add_parser("import-orphans", help="Move orphan files and insert into DB with hcp_id")
+    reconcile_parser = sub.add_parser("reconcile-db", help="Update DB with hcp_id/path from existing S3 files")
+    reconcile_parser.add_argument("--verify-head", type=int, default=0, metavar="N", help="HEAD-check N random matched keys against the listing")
+    reconcile_parser.add_argument("--trust-manifest", action="store_true", help=f"Reuse a manifest younger than {MANIFEST_MAX_AGE // 3600}h instead of re-listing; only safe while nothing else writes the bucket")
+    reconcile_parser.add_argument("--stream", action="store_true", help="Stream table rows with a server-side cursor")
+    reconcile_parser.add_argument("--bulk-merge", action="store_true", help="Stage matches in a temporary table and apply them with one UPDATE ... JOIN")
+    reconcile_parser.add_argument("--fetch-size", type=int, default=STREAM_FETCH_SIZE, help=f"Rows per fetch when streaming (default: {STREAM_FETCH_SIZE})")
+    reconcile_parser.add_argument("--commit-rows", type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many updated rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+    reconcile_parser.add_argument("--workers", type=int, default=1, help="Threads reconciling id ranges in parallel, each on its own connection; they only do DB I/O, fuzzy scoring runs in --match-processes (default: 1)")
+    reconcile_parser.add_argument("--resume", action="store_true", help=f"Continue after the last id saved in {CHECKPOINT_FILE}")
+    reconcile_parser.add_argument("--match-processes", type=int, default=0, help="Processes for fuzzy matching, 1 to match in-process (default: all cores)")
+    reconcile_parser.add_argument("--vector-match", action="store_true", help=f"Shortlist fuzzy candidates with batched NumPy cosine similarity (needs numpy; {FUZZY_VECTOR_DIM * 4} bytes per S3 key, ~2 GB at 2M keys)")
+    reconcile_parser.add_argument("--no-fuzzy-cache", action="store_true", help=f"Ignore fuzzy match decisions cached in {MANIFEST_DB}")
+    reconcile_parser.add_argument("--incremental", action="store_true", help=f"Only select legacy, unreconciled or changed rows since the watermark in {WATERMARK_FILE}")
+    reconcile_parser.add_argument("--updated-column", help="Timestamp column (e.g. updated_at) that also marks changed rows in --incremental mode")
+    reconcile_parser.add_argument("--commit-seconds", type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
+    reconcile_parser.add_argument("--sql-join", action="store_true", help="Apply exact matches with indexed joins on filename_norm first (needs normalize-columns)")
+    orphans_parser = sub.add_parser("find-orphans", help="Find S3 files not tracked in DB")
+    orphans_parser.add_argument("--trust-manifest", action="store_true", help=f"Reuse a manifest younger than {MANIFEST_MAX_AGE // 3600}h instead of re-listing; only safe while nothing else writes the bucket")
+    orphans_parser.add_argument("--stream", action="store_true", help="Stream table rows with a server-side cursor")
+    orphans_parser.add_argument("--fetch-size", type=int, default=STREAM_FETCH_SIZE, help=f"Rows per fetch when streaming (default: {STREAM_FETCH_SIZE})")
+    orphans_parser.add_argument("--merge", action="store_true", help="Stream both sides through a sort-merge join instead of building sets (flat memory)")
+    orphans_parser.add_argument("--bloom", action="store_true", help="Check keys against a Bloom filter of DB paths and confirm hits in the DB")
+    orphans_parser.add_argument("--bloom-error-rate", type=float, default=BLOOM_ERROR_RATE, help=f"Bloom filter false-positive rate (default: {BLOOM_ERROR_RATE})")
+    orphans_parser.add_argument("--sql-join", action="store_true", help="Anti-join staged keys against the path_norm index (needs normalize-columns)")
+    import_parser = sub.add_parser("import-orphans", help="Move orphan files and insert into DB with hcp_id")
+    import_parser.add_argument("--commit-rows", type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many inserted rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+    import_parser.add_argument("--commit-seconds", type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
+    import_parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help=f"Concurrent server-side copies (default: {IMPORT_WORKERS})")
+    import_parser.add_argument("--insert-batch", type=int, default=INSERT_BATCH_SIZE, help=f"Rows per INSERT ... ON DUPLICATE KEY UPDATE statement (default: {INSERT_BATCH_SIZE})")
 
     sync_parser = sub.add_parser("sync", help="Upload files and update DB in one pass")
     sync_parser.add_argument("--dry-run", action="store_true", help="Perform a dry run (no changes)")
     sync_parser.add_argument("--workers", type=int, default=5, help="Number of parallel threads (default: 5)")
+    sync_parser.add_argument("--match-processes", type=int, default=0, help="Processes for fuzzy matching, 1 to match in-process (default: all cores)")
+    sync_parser.add_argument("--no-fuzzy-cache", action="store_true", help=f"Ignore fuzzy match decisions cached in {MANIFEST_DB}")
+    sync_parser.add_argument("--trust-manifest", action="store_true", help=f"Reuse a manifest younger than {MANIFEST_MAX_AGE // 3600}h instead of re-listing; only safe while nothing else writes the bucket")
+    sync_parser.add_argument("--stream", action="store_true", help="Stream table rows with a server-side cursor")
+    sync_parser.add_argument("--fetch-size", type=int, default=STREAM_FETCH_SIZE, help=f"Rows per fetch when streaming (default: {STREAM_FETCH_SIZE})")
+    sync_parser.add_argument("--commit-rows", type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many updated rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+    sync_parser.add_argument("--commit-seconds", type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
+    sync_parser.add_argument("--sql-join", action="store_true", help="Find DB rows with indexed joins on filename_norm (needs normalize-columns)")
+    norm_parser = sub.add_parser("normalize-columns", help="Add the indexed filename_norm/path_norm columns and backfill them")
+    norm_parser.add_argument("--all", action="store_true", help="Recompute every row, e.g. after other tools changed url or path")
+    norm_parser.add_argument("--batch-size", type=int, default=NORM_BACKFILL_BATCH, help=f"Rows per backfill UPDATE (default: {NORM_BACKFILL_BATCH})")
+    norm_parser.add_argument("--commit-rows", type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+    norm_parser.add_argument("--commit-seconds", type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
 
     args = parser.parse_args()
+    if args.command == "reconcile-db" and args.resume and args.workers > 1:
+        parser.error("--resume is only supported with a single worker")
+    if args.command == "find-orphans" and args.merge and args.bloom:
+        parser.error("--merge and --bloom are separate modes, pick one")
+    if getattr(args, "vector_match", False) and np is None:
+        parser.error("--vector-match needs numpy (pip install numpy)")
+    if getattr(args, "sql_join", False) and not norm_columns_usable():
+        logger.warning("--sql-join falls back to matching in Python for this run")
+        args.sql_join = False
 
     try:
         if args.command == "migrate":
@@ -526,10 +2521,13 @@ if __name__ == "__main__":
             import_orphans(args)
         elif args.command == "sync":
             sync(args)
+        elif args.command == "normalize-columns":
+            normalize_columns(args)
         else:
             parser.print_help()
     finally:
         db.close()
+        manifest.close()
 
 # === USAGE ===
 # Dry run: see what would happen
@@ -537,6 +2535,10 @@ if __name__ == "__main__":
 #
 # Real upload & DB update
 # python script.py sync --workers 10
+#
+# One-time: add and backfill the normalized columns, then match with indexed joins
+# python script.py normalize-columns
+# python script.py reconcile-db --sql-join
 
 
 
@@ -581,10 +2583,15 @@ import boto3
 import pymysql
 import logging
 import urllib3
+import math
+import heapq
 import argparse
+import random
 import unicodedata
 from pathlib import Path
-from difflib import get_close_matches
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from difflib import SequenceMatcher
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -606,6 +2613,8 @@ TARGET_PREFIX = "legacy/"
 ORPHAN_CSV = "orphaned_s3_files.csv"
 INSERT_LOG_CSV = "imported_orphan_files.csv"
 UNMATCHED_OUTPUT = "unmatched_files.csv"
+FUZZY_CUTOFF = 0.85
+FUZZY_SHORTLIST = 50
 
 # === LOGGING ===
 logging.basicConfig(
@@ -660,6 +2669,74 @@ def upload_file(local_path, s3_key):
         logger.error(f"Error uploading {local_path}: {e}")
         return None
 
+def get_s3_index(prefix):
+    s3_index = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            s3_index[obj["Key"]] = (obj.get("ETag", "").strip('"'), obj["Size"], obj["LastModified"])
+    logger.info(f"Indexed {len(s3_index)} S3 keys under {prefix}")
+    return s3_index
+
+def index_etag(s3_index, key):
+    entry = s3_index.get(key)
+    return entry[0] if entry else None
+
+def verify_index_sample(s3_index, keys, sample_size):
+    sample = random.sample(keys, min(sample_size, len(keys)))
+    mismatched = 0
+    for key in sample:
+        etag = s3_object_exists(key)
+        if etag != index_etag(s3_index, key):
+            mismatched += 1
+            logger.warning(f"[VERIFY] {key} listing ETag {index_etag(s3_index, key)} != HEAD ETag {etag}")
+    logger.info(f"Verified {len(sample)} matched keys with HEAD, {mismatched} mismatched")
+
+# === FUZZY INDEX ===
+# Trigram postings over the normalized names, ordered by name length so a lookup only
+# counts shared grams inside the length band where the ratio can reach the cutoff.
+# The names sharing the most grams are then scored exactly like get_close_matches().
+class FuzzyIndex:
+    def __init__(self, names, gram_size=3, shortlist=FUZZY_SHORTLIST):
+        self.gram_size = gram_size
+        self.shortlist = shortlist
+        self.names = sorted({name for name in names if name}, key=len)
+        self.lengths = [len(name) for name in self.names]
+        self.postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in self.grams(name):
+                self.postings[gram].append(i)
+        logger.info(f"Built fuzzy index over {len(self.names)} names ({len(self.postings)} trigrams)")
+
+    def grams(self, name):
+        pad = " " * (self.gram_size - 1)
+        padded = f"{pad}{name}{pad}"
+        return {padded[i:i + self.gram_size] for i in range(len(padded) - self.gram_size + 1)}
+
+    def lookup(self, name, cutoff=FUZZY_CUTOFF):
+        if not name or not self.names:
+            return None
+
+        lo = bisect_left(self.lengths, math.ceil(len(name) * cutoff / (2 - cutoff) - 1e-9))
+        hi = bisect_right(self.lengths, math.floor(len(name) * (2 - cutoff) / cutoff + 1e-9))
+        shared = defaultdict(int)
+        for gram in self.grams(name):
+            posting = self.postings.get(gram)
+            if posting:
+                for i in posting[bisect_left(posting, lo):bisect_left(posting, hi)]:
+                    shared[i] += 1
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(name)
+        best = None
+        for i in heapq.nlargest(self.shortlist, shared, key=shared.get):
+            matcher.set_seq1(self.names[i])
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, self.names[i]) > best):
+                    best = (score, self.names[i])
+        return best[1] if best else None
+
 # === MIGRATE FILES ===
 def migrate(args):
     source_path = Path(SOURCE_DIR)
@@ -676,13 +2753,9 @@ def migrate(args):
 def reconcile(args):
     updated = 0
     unmatched = []
-    all_s3_keys = []
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=TARGET_PREFIX):
-        all_s3_keys.extend([
-            obj["Key"].replace(TARGET_PREFIX, "")
-            for obj in page.get("Contents", [])
-        ])
+    matched_keys = []
+    s3_index = get_s3_index(TARGET_PREFIX)
+    fuzzy_index = FuzzyIndex(key.replace(TARGET_PREFIX, "") for key in s3_index)
 
     with db.cursor() as cursor:
         cursor.execute(f"SELECT id, url FROM {TABLE_NAME}")
@@ -693,13 +2766,14 @@ def reconcile(args):
                 continue
             filename = normalize_filename(url.split("/")[-1])
             s3_key = f"{TARGET_PREFIX}{filename}"
-            etag = s3_object_exists(s3_key)
+            etag = index_etag(s3_index, s3_key)
             if not etag:
-                match = get_close_matches(filename, all_s3_keys, n=1, cutoff=0.85)
+                match = fuzzy_index.lookup(filename)
                 if match:
-                    s3_key = f"{TARGET_PREFIX}{match[0]}"
-                    etag = s3_object_exists(s3_key)
+                    s3_key = f"{TARGET_PREFIX}{match}"
+                    etag = index_etag(s3_index, s3_key)
             if etag:
+                matched_keys.append(s3_key)
                 new_url = f"{ENDPOINT_URL.rstrip('/')}/{s3_key}"
                 cursor.execute(
                     f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s, url = %s WHERE id = %s",
@@ -716,6 +2790,9 @@ def reconcile(args):
         for row in unmatched:
             writer.writerow(row)
 
+    if args.verify_head and matched_keys:
+        verify_index_sample(s3_index, matched_keys, args.verify_head)
+
     logger.info(f"Reconciled {updated} rows. Unmatched written to {UNMATCHED_OUTPUT}")
 
 # === FIND ORPHANS ===
@@ -783,7 +2860,8 @@ if __name__ == "__main__":
     sub = parser.add_subparsers(dest="command")
 
     sub.add_parser("migrate", help="Upload all files from source directory to S3")
-    sub.add_parser("reconcile-db", help="Update DB with hcp_id/path from existing S3 files")
+    reconcile_parser = sub.add_parser("reconcile-db", help="Update DB with hcp_id/path from existing S3 files")
+    reconcile_parser.add_argument("--verify-head", type=int, default=0, metavar="N", help="HEAD-check N random matched keys against the listing")
     sub.add_parser("find-orphans", help="Find S3 files not tracked in DB")
     sub.add_parser("import-orphans", help="Move orphan files and insert into DB with hcp_id")
 
@@ -846,15 +2924,19 @@ if __name__ == "__main__":
 
 
 
+
 
 
 #!/usr/bin/env python3
 import boto3
 import pymysql
 import csv
+import time
+import sqlite3
 import logging
 import urllib3
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -868,6 +2950,11 @@ BUCKET_NAME = "adam"
 ENDPOINT_URL = "https://your-hcp-endpoint.com"
 ORPHAN_CSV = "orphaned_s3_files.csv"
 INSERT_LOG_CSV = "imported_orphan_files.csv"
+COMMIT_EVERY_ROWS = 1000
+COMMIT_EVERY_SECONDS = 0
+MANIFEST_DB = "s3_manifest.sqlite"
+COPY_WORKERS = 8
+DELETE_BATCH_SIZE = 1000
 
 # LOGGING
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -891,59 +2978,174 @@ s3 = boto3.client(
     verify=False
 )
 
+# Keep the sync tool's local key manifest in step with the moves made here
+manifest = sqlite3.connect(MANIFEST_DB)
+manifest.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, etag TEXT, size INTEGER, last_modified TEXT)")
+
 def normalize_filename(name):
     if not name:
         return None
     return unicodedata.normalize("NFC", name).strip()
 
-def move_and_import():
-    with open(ORPHAN_CSV, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        inserted = []
+# Commits whenever `every_rows` inserts or `every_seconds` have accumulated (0 disables
+# either limit) and logs each chunk's size and timing.
+class ChunkedCommitter:
+    def __init__(self, conn, label, every_rows=COMMIT_EVERY_ROWS, every_seconds=COMMIT_EVERY_SECONDS):
+        self.conn = conn
+        self.label = label
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.pending = 0
+        self.committed = 0
+        self.chunks = 0
+        self.chunk_start = time.monotonic()
+
+    def tick(self, rows=1):
+        self.pending += rows
+        if self.every_rows and self.pending >= self.every_rows:
+            self.commit()
+        elif self.every_seconds and time.monotonic() - self.chunk_start >= self.every_seconds:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        commit_start = time.monotonic()
+        self.conn.commit()
+        now = time.monotonic()
+        elapsed = now - self.chunk_start
+        self.chunks += 1
+        self.committed += self.pending
+        logger.info(
+            f"[COMMIT] {self.label} chunk {self.chunks}: {self.pending} rows in {elapsed:.2f}s "
+            f"({self.pending / elapsed if elapsed else 0:.0f} rows/s, commit {now - commit_start:.2f}s)"
+        )
+        self.pending = 0
+        self.chunk_start = now
+
+    def finish(self):
+        self.commit()
+        logger.info(f"[COMMIT] {self.label}: {self.committed} rows committed in {self.chunks} chunks")
+
+def copy_orphan(key, new_key):
+    copied = s3.copy_object(
+        Bucket=BUCKET_NAME,
+        CopySource={'Bucket': BUCKET_NAME, 'Key': key},
+        Key=new_key
+    )
+    return copied.get("CopyObjectResult", {})
+
+# Writes a batch of finished copies with one multi-row upsert (re-runs don't duplicate
+# rows as long as path has a unique key) and commits it, then deletes the sources with
+# one delete_objects call. Sources are only deleted once their rows are committed.
+def finish_batch(cursor, committer, batch, inserted):
+    rows = [row for _, row in batch]
+    try:
+        cursor.executemany(
+            f"INSERT INTO {TABLE_NAME} (name, url, path) VALUES (%s, %s, %s) "
+            f"ON DUPLICATE KEY UPDATE name = VALUES(name), url = VALUES(url)",
+            [(row["name"], row["url"], row["path"]) for row in rows]
+        )
+        committer.tick(len(rows))
+        committer.commit()
+    except Exception as e:
+        conn.rollback()
+        for key, row in batch:
+            logger.error(f"Failed to insert {row['path']}, keeping source {key}: {e}")
+        return
+    inserted.extend(rows)
 
-        with conn.cursor() as cursor:
-            for row in reader:
-                key = normalize_filename(row["orphaned_s3_key"])
-                filename = key.split("/")[-1]
-                new_key = f"legacy/orphan/{filename}"
+    try:
+        response = s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={"Objects": [{"Key": key} for key, _ in batch], "Quiet": True}
+        )
+        delete_errors = {error["Key"]: error.get("Message") for error in response.get("Errors", [])}
+    except Exception as e:
+        delete_errors = {key: str(e) for key, _ in batch}
 
-                try:
-                    # Copy and delete original
-                    s3.copy_object(
-                        Bucket=BUCKET_NAME,
-                        CopySource={'Bucket': BUCKET_NAME, 'Key': key},
-                        Key=new_key
-                    )
-                    s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+    for key, row in batch:
+        if key in delete_errors:
+            logger.error(f"Failed to delete {key} after copying to {row['path']}: {delete_errors[key]}")
+        else:
+            manifest.execute("DELETE FROM objects WHERE key = ?", (key,))
+    manifest.commit()
 
-                    # Insert into DB
-                    hcp_url = f"{ENDPOINT_URL.rstrip('/')}/{new_key}"
-                    cursor.execute(
-                        f"INSERT INTO {TABLE_NAME} (name, url, path) VALUES (%s, %s, %s)",
-                        (filename, hcp_url, new_key)
-                    )
-                    inserted.append({"name": filename, "path": new_key, "url": hcp_url})
-                    logger.info(f"Imported {filename} → {new_key}")
+def move_and_import():
+    orphans = []
+    skipped = 0
+    with open(ORPHAN_CSV, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            # find-orphans marks byte-identical copies of tracked objects
+            if row.get("classification", "unique").startswith("duplicate of"):
+                logger.info(f"Skipping {row['orphaned_s3_key']}: {row['classification']}")
+                skipped += 1
+                continue
+            orphans.append((normalize_filename(row["orphaned_s3_key"]), int(row["size"]) if row.get("size") else None))
+
+    # Orphans in different folders can share a basename and so a target key; only the
+    # first orphan per target is moved, since the upsert would fold the rest into its row
+    targets = {}
+    collisions = 0
+    for key, size in orphans:
+        new_key = f"legacy/orphan/{key.split('/')[-1]}"
+        if new_key in targets:
+            logger.error(f"Skipping {key}: {new_key} is already the target of {targets[new_key][0]}")
+            collisions += 1
+        else:
+            targets[new_key] = (key, size)
 
-                except Exception as e:
-                    logger.error(f"Failed to move or insert {key}: {e}")
+    inserted = []
+    batch = []
+    committer = ChunkedCommitter(conn, "move-and-import")
 
-            conn.commit()
+    with conn.cursor() as cursor, ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        futures = {}
+        for new_key, (key, size) in targets.items():
+            filename = key.split("/")[-1]
+            futures[executor.submit(copy_orphan, key, new_key)] = (key, filename, new_key, size)
 
-        with open(INSERT_LOG_CSV, "w", newline='', encoding="utf-8") as out:
-            writer = csv.DictWriter(out, fieldnames=["name", "path", "url"])
-            writer.writeheader()
-            for row in inserted:
-                writer.writerow(row)
+        for future in as_completed(futures):
+            key, filename, new_key, size = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Failed to copy {key}: {e}")
+                continue
 
-        logger.info(f"Imported {len(inserted)} orphaned files into DB and moved to /legacy/orphan/")
-        logger.info(f"Wrote import log to {INSERT_LOG_CSV}")
+            manifest.execute(
+                "INSERT OR REPLACE INTO objects (key, etag, size, last_modified) VALUES (?, ?, ?, ?)",
+                (new_key, result.get("ETag", "").strip('"'), size, result["LastModified"].isoformat() if "LastModified" in result else None)
+            )
+            hcp_url = f"{ENDPOINT_URL.rstrip('/')}/{new_key}"
+            batch.append((key, {"name": filename, "path": new_key, "url": hcp_url}))
+            logger.info(f"Copied {filename} → {new_key}")
+            if len(batch) >= DELETE_BATCH_SIZE:
+                finish_batch(cursor, committer, batch, inserted)
+                batch = []
+
+        if batch:
+            finish_batch(cursor, committer, batch, inserted)
+        committer.finish()
+
+    with open(INSERT_LOG_CSV, "w", newline='', encoding="utf-8") as out:
+        writer = csv.DictWriter(out, fieldnames=["name", "path", "url"])
+        writer.writeheader()
+        for row in inserted:
+            writer.writerow(row)
+
+    logger.info(f"Imported {len(inserted)} orphaned files into DB and moved to /legacy/orphan/")
+    logger.info(f"Skipped {skipped} duplicate copies of tracked objects")
+    if collisions:
+        logger.warning(f"Skipped {collisions} orphans whose filename collides with another orphan's, rename and re-run them")
+    logger.info(f"Wrote import log to {INSERT_LOG_CSV}")
 
 if __name__ == "__main__":
     try:
         move_and_import()
     finally:
         conn.close()
+        manifest.close()
 
 
 
@@ -970,6 +3172,8 @@ if __name__ == "__main__":
 
 
 #!/usr/bin/env python3
+import math
+import heapq
 import boto3
 import pymysql
 import urllib.parse
@@ -977,9 +3181,13 @@ import urllib3
 import logging
 import argparse
 import csv
+import time
 import unicodedata
+import random
 import sys
-from difflib import get_close_matches
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from difflib import SequenceMatcher
 
 # Disable SSL warnings and force UTF-8 output
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -997,12 +3205,22 @@ ACCESS_KEY = "your-s3-access-key"
 SECRET_KEY = "your-s3-secret-key"
 ENDPOINT_URL = "https://your-hcp-endpoint.com"
 UNMATCHED_OUTPUT = "unmatched_files.csv"
+FUZZY_CUTOFF = 0.85
+FUZZY_SHORTLIST = 50
+STREAM_FETCH_SIZE = 10000
+COMMIT_EVERY_ROWS = 1000
+COMMIT_EVERY_SECONDS = 0
 
 # CLI ARGS
 parser = argparse.ArgumentParser(description="HCP S3 Reconciliation Tool")
 parser.add_argument('--dry-run', action='store_true', help="Skip DB updates")
 parser.add_argument('--log-file', help="Optional log output file")
 parser.add_argument('--find-orphans', action='store_true', help="Find S3 files not tracked in DB")
+parser.add_argument('--verify-head', type=int, default=0, metavar='N', help="HEAD-check N random matched keys against the listing")
+parser.add_argument('--stream', action='store_true', help="Stream table rows with a server-side cursor")
+parser.add_argument('--fetch-size', type=int, default=STREAM_FETCH_SIZE, help=f"Rows per fetch when streaming (default: {STREAM_FETCH_SIZE})")
+parser.add_argument('--commit-rows', type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many updated rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+parser.add_argument('--commit-seconds', type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
 args = parser.parse_args()
 
 # LOGGING
@@ -1044,6 +3262,33 @@ def normalize_filename(name):
         return None
     return unicodedata.normalize("NFC", name).strip()
 
+# Yields the rows of `sql`. With --stream, a separate connection reads them through a
+# server-side cursor a fetch at a time, so the table is never held as one list and
+# `conn` stays free for the updates.
+def fetch_rows(sql):
+    if not args.stream:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            yield from cursor.fetchall()
+        return
+    read_conn = pymysql.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASS,
+        database=DB_NAME,
+        cursorclass=pymysql.cursors.SSDictCursor
+    )
+    try:
+        with read_conn.cursor() as cursor:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(args.fetch_size)
+                if not rows:
+                    break
+                yield from rows
+    finally:
+        read_conn.close()
+
 def s3_object_exists(key):
     try:
         response = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
@@ -1053,16 +3298,118 @@ def s3_object_exists(key):
             return None
         raise
 
-def fuzzy_lookup(filename, s3_keys, cutoff=0.85):
-    matches = get_close_matches(filename, s3_keys, n=1, cutoff=cutoff)
-    return matches[0] if matches else None
+# Listing index: key -> (etag, size, last_modified)
+def build_s3_index():
+    s3_index = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PREFIX):
+        for obj in page.get("Contents", []):
+            s3_index[obj["Key"]] = (obj.get("ETag", "").strip('"'), obj["Size"], obj["LastModified"])
+    logger.info(f"Indexed {len(s3_index)} S3 keys from listing")
+    return s3_index
+
+def index_etag(s3_index, key):
+    entry = s3_index.get(key)
+    return entry[0] if entry else None
+
+def verify_index_sample(s3_index, keys, sample_size):
+    sample = random.sample(keys, min(sample_size, len(keys)))
+    mismatched = 0
+    for key in sample:
+        etag = s3_object_exists(key)
+        if etag != index_etag(s3_index, key):
+            mismatched += 1
+            logger.warning(f"[VERIFY] {key} listing ETag {index_etag(s3_index, key)} != HEAD ETag {etag}")
+    logger.info(f"Verified {len(sample)} keys with HEAD, {mismatched} mismatched")
+
+# Trigram postings over the normalized names, ordered by name length so a lookup only
+# counts shared grams inside the length band where the ratio can reach the cutoff.
+# The names sharing the most grams are then scored exactly like get_close_matches().
+class FuzzyIndex:
+    def __init__(self, names, gram_size=3, shortlist=FUZZY_SHORTLIST):
+        self.gram_size = gram_size
+        self.shortlist = shortlist
+        self.names = sorted({name for name in names if name}, key=len)
+        self.lengths = [len(name) for name in self.names]
+        self.postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in self.grams(name):
+                self.postings[gram].append(i)
+        logger.info(f"Built fuzzy index over {len(self.names)} names ({len(self.postings)} trigrams)")
+
+    def grams(self, name):
+        pad = " " * (self.gram_size - 1)
+        padded = f"{pad}{name}{pad}"
+        return {padded[i:i + self.gram_size] for i in range(len(padded) - self.gram_size + 1)}
+
+    def lookup(self, name, cutoff=FUZZY_CUTOFF):
+        if not name or not self.names:
+            return None
+
+        lo = bisect_left(self.lengths, math.ceil(len(name) * cutoff / (2 - cutoff) - 1e-9))
+        hi = bisect_right(self.lengths, math.floor(len(name) * (2 - cutoff) / cutoff + 1e-9))
+        shared = defaultdict(int)
+        for gram in self.grams(name):
+            posting = self.postings.get(gram)
+            if posting:
+                for i in posting[bisect_left(posting, lo):bisect_left(posting, hi)]:
+                    shared[i] += 1
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(name)
+        best = None
+        for i in heapq.nlargest(self.shortlist, shared, key=shared.get):
+            matcher.set_seq1(self.names[i])
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, self.names[i]) > best):
+                    best = (score, self.names[i])
+        return best[1] if best else None
+
+# Commits whenever `every_rows` updates or `every_seconds` have accumulated (0 disables
+# either limit) and logs each chunk's size and timing.
+class ChunkedCommitter:
+    def __init__(self, conn, label, every_rows=COMMIT_EVERY_ROWS, every_seconds=COMMIT_EVERY_SECONDS):
+        self.conn = conn
+        self.label = label
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.pending = 0
+        self.committed = 0
+        self.chunks = 0
+        self.chunk_start = time.monotonic()
+
+    def tick(self, rows=1):
+        self.pending += rows
+        if self.every_rows and self.pending >= self.every_rows:
+            self.commit()
+        elif self.every_seconds and time.monotonic() - self.chunk_start >= self.every_seconds:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        commit_start = time.monotonic()
+        self.conn.commit()
+        now = time.monotonic()
+        elapsed = now - self.chunk_start
+        self.chunks += 1
+        self.committed += self.pending
+        logger.info(
+            f"[COMMIT] {self.label} chunk {self.chunks}: {self.pending} rows in {elapsed:.2f}s "
+            f"({self.pending / elapsed if elapsed else 0:.0f} rows/s, commit {now - commit_start:.2f}s)"
+        )
+        self.pending = 0
+        self.chunk_start = now
+
+    def finish(self):
+        self.commit()
+        logger.info(f"[COMMIT] {self.label}: {self.committed} rows committed in {self.chunks} chunks")
 
 def find_orphaned_s3_files():
     logger.info("Checking for orphaned files in S3...")
 
-    with conn.cursor() as cursor:
-        cursor.execute(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL")
-        db_paths = set(normalize_filename(row['path'].lower()) for row in cursor.fetchall())
+    db_paths = set(normalize_filename(row['path'].lower()) for row in fetch_rows(f"SELECT path FROM {TABLE_NAME} WHERE path IS NOT NULL"))
 
     s3_keys = []
     paginator = s3_client.get_paginator('list_objects_v2')
@@ -1085,21 +3432,14 @@ def find_orphaned_s3_files():
 def reconcile():
     updated = 0
     unmatched = []
+    matched_keys = []
 
-    all_s3_keys = []
-    paginator = s3_client.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PREFIX):
-        all_s3_keys.extend([
-            obj["Key"].replace(PREFIX, "")
-            for obj in page.get("Contents", [])
-        ])
-    logger.info(f"Cached {len(all_s3_keys)} S3 keys")
+    s3_index = build_s3_index()
+    fuzzy_index = FuzzyIndex(key.replace(PREFIX, "") for key in s3_index)
+    committer = ChunkedCommitter(conn, "reconcile", args.commit_rows, args.commit_seconds)
 
     with conn.cursor() as cursor:
-        cursor.execute(f"SELECT id, url FROM {TABLE_NAME}")
-        rows = cursor.fetchall()
-
-        for row in rows:
+        for row in fetch_rows(f"SELECT id, url FROM {TABLE_NAME}"):
             url = row["url"]
             if not url or not url.lower().startswith(("https://server/artifacts/", "http://server/artifacts/")):
                 continue
@@ -1110,19 +3450,20 @@ def reconcile():
                 continue
 
             s3_key = normalize_filename(f"{PREFIX}{file_name}")
-            etag = s3_object_exists(s3_key)
+            etag = index_etag(s3_index, s3_key)
 
             if not etag:
-                fuzzy_match = fuzzy_lookup(file_name, all_s3_keys)
+                fuzzy_match = fuzzy_index.lookup(file_name)
                 if fuzzy_match:
                     fuzzy_key = normalize_filename(f"{PREFIX}{fuzzy_match}")
                     logger.warning(f"[FUZZY] {file_name} ≈ {fuzzy_match}")
-                    etag = s3_object_exists(fuzzy_key)
+                    etag = index_etag(s3_index, fuzzy_key)
                     if etag:
                         s3_key = fuzzy_key
 
             if etag:
                 logger.info(f"[MATCHED] {file_name} → {s3_key}")
+                matched_keys.append(s3_key)
                 if not args.dry_run:
                     new_url = f"{ENDPOINT_URL.rstrip('/')}/{s3_key}"
                     cursor.execute(
@@ -1130,12 +3471,13 @@ def reconcile():
                         (etag, s3_key, new_url, row["id"])
                     )
                     updated += 1
+                    committer.tick()
             else:
                 unmatched.append({"id": row["id"], "url": url, "expected_key": s3_key})
                 logger.warning(f"[MISSING] {file_name} not found → Raw: {repr(file_name)}")
 
     if not args.dry_run:
-        conn.commit()
+        committer.finish()
 
     if unmatched:
         with open(UNMATCHED_OUTPUT, "w", newline='', encoding="utf-8") as csvfile:
@@ -1146,6 +3488,9 @@ def reconcile():
                 writer.writerow(row)
         logger.info(f"Exported {len(unmatched)} unmatched rows to {UNMATCHED_OUTPUT}")
 
+    if args.verify_head and matched_keys:
+        verify_index_sample(s3_index, matched_keys, args.verify_head)
+
     logger.info(f"Updated {updated} rows in DB (dry run: {args.dry_run})")
 
 # MAIN
@@ -93,6 +93,8 @@ import urllib3
 import argparse
 import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # Disable SSL warnings
@@ -105,6 +107,8 @@ ENDPOINT_URL = "https://example.com"
 BUCKET_NAME = "adam"
 SOURCE_DIR = "Y:/path/to/share"  # Your network share path
 TARGET_PREFIX = "new-adam"  # Folder name in HCP bucket
+LIST_WORKERS = 16  # Concurrent listing shards
+LIST_SHARD_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
 
 # Configure logging
 logging.basicConfig(
@@ -123,10 +127,37 @@ s3_client = boto3.client(
     aws_access_key_id=ACCESS_KEY,
     aws_secret_access_key=SECRET_KEY,
     endpoint_url=ENDPOINT_URL,
-    verify=False  # Disable SSL verification
+    verify=False,  # Disable SSL verification
+    # One pooled connection per listing worker (botocore defaults to 10)
+    config=Config(max_pool_connections=LIST_WORKERS)
 )
 
 
+def list_objects_shard(prefix, lower, upper):
+    """List the keys under prefix in the range (lower, upper]"""
+    objects = []
+    params = {'Bucket': BUCKET_NAME, 'Prefix': prefix}
+    if lower:
+        params['StartAfter'] = lower
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            if upper and obj['Key'] > upper:
+                return objects
+            objects.append(obj)
+    return objects
+
+
+def list_objects_parallel(prefix, workers=LIST_WORKERS):
+    """Yield every object under prefix in key order, listing shards concurrently"""
+    # Shards split at prefix + <char>, so together they cover each key exactly once
+    bounds = [f"{prefix}{c}" for c in LIST_SHARD_CHARS] if workers > 1 else []
+    shards = list(zip([None] + bounds, bounds + [None]))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for objects in executor.map(lambda shard: list_objects_shard(prefix, *shard), shards):
+            yield from objects
+
+
 def create_folder(folder_name=None):
     """Create a new folder in the bucket"""
     # Use TARGET_PREFIX if no folder name provided
@@ -218,24 +249,27 @@ def delete_folder(prefix=None):
     print(f"Deleting folder {BUCKET_NAME}/{prefix} and all its contents...")
     
     try:
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix)
-        
         deleted_count = 0
-        for page in page_iterator:
-            if 'Contents' in page:
-                objects_to_delete = [{'Key': obj['Key']} for obj in page['Contents']]
-                if objects_to_delete:
-                    s3_client.delete_objects(
-                        Bucket=BUCKET_NAME,
-                        Delete={'Objects': objects_to_delete}
-                    )
-                    deleted_count += len(objects_to_delete)
-                    logger.info(f"Deleted {len(objects_to_delete)} objects in this batch")
-                    
-                    # Show progress for large folders
-                    if deleted_count % 100 == 0:
-                        print(f"Deleted {deleted_count} objects so far...")
+        # Each listing page holds at most 1000 keys, which is also the delete_objects
+        # limit, so pages are deleted as they arrive instead of collecting every key first
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+            objects_to_delete = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if not objects_to_delete:
+                continue
+            response = s3_client.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={'Objects': objects_to_delete, 'Quiet': True}
+            )
+            errors = response.get('Errors', [])
+            for error in errors:
+                logger.error(f"Error deleting {error['Key']}: {error.get('Message')}")
+            deleted_count += len(objects_to_delete) - len(errors)
+            logger.info(f"Deleted {len(objects_to_delete) - len(errors)} objects in this batch")
+            
+            # Show progress for large folders
+            if deleted_count % 100 == 0:
+                print(f"Deleted {deleted_count} objects so far...")
         
         # Delete the folder itself (the trailing slash object)
         s3_client.delete_object(Bucket=BUCKET_NAME, Key=prefix)
@@ -287,14 +321,9 @@ def get_folder_stats(prefix=None):
         total_size = 0
         total_count = 0
         
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix)
-        
-        for page in page_iterator:
-            if 'Contents' in page:
-                total_count += len(page['Contents'])
-                for obj in page['Contents']:
-                    total_size += obj['Size']
+        for obj in list_objects_parallel(prefix):
+            total_count += 1
+            total_size += obj['Size']
         
         total_size_mb = total_size / (1024 * 1024)
         total_size_gb = total_size / (1024 ** 3)
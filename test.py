@@ -6,7 +6,9 @@ import urllib3
 import logging
 import argparse
 import csv
+import time
 import unicodedata
+import random
 import sys
 
 # --- Disable SSL warnings and fix stdout encoding ---
@@ -28,11 +30,16 @@ SECRET_KEY = "your-s3-secret-key"
 ENDPOINT_URL = "https://your-hcp-endpoint.com"
 
 UNMATCHED_OUTPUT = "unmatched_files.csv"
+COMMIT_EVERY_ROWS = 1000
+COMMIT_EVERY_SECONDS = 0
 
 # --- Setup Args ---
 parser = argparse.ArgumentParser(description="Reconcile MySQL entries with HCP S3 bucket")
 parser.add_argument('--dry-run', action='store_true', help="Do not write to DB")
 parser.add_argument('--log-file', help="Write logs to file")
+parser.add_argument('--verify-head', type=int, default=0, metavar='N', help="HEAD-check N random matched keys against the listing")
+parser.add_argument('--commit-rows', type=int, default=COMMIT_EVERY_ROWS, help=f"Commit after this many updated rows, 0 to disable (default: {COMMIT_EVERY_ROWS})")
+parser.add_argument('--commit-seconds', type=float, default=COMMIT_EVERY_SECONDS, help="Also commit after this many seconds, 0 to disable")
 args = parser.parse_args()
 
 # --- Setup Logging ---
@@ -89,9 +96,74 @@ def s3_object_exists(key):
             return None
         raise
 
+# --- Listing index: key -> (etag, size, last_modified) ---
+def build_s3_index():
+    s3_index = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PREFIX):
+        for obj in page.get("Contents", []):
+            s3_index[obj["Key"]] = (obj.get("ETag", "").strip('"'), obj["Size"], obj["LastModified"])
+    logger.info(f"Indexed {len(s3_index)} S3 keys from listing")
+    return s3_index
+
+def verify_index_sample(s3_index, keys, sample_size):
+    sample = random.sample(keys, min(sample_size, len(keys)))
+    mismatched = 0
+    for key in sample:
+        etag = s3_object_exists(key)
+        if etag != s3_index[key][0]:
+            mismatched += 1
+            logger.warning(f"[VERIFY] {key} listing ETag {s3_index[key][0]} != HEAD ETag {etag}")
+    logger.info(f"Verified {len(sample)} keys with HEAD, {mismatched} mismatched")
+
+# --- Chunked commits ---
+# Commits whenever `every_rows` updates or `every_seconds` have accumulated (0 disables
+# either limit) and logs each chunk's size and timing.
+class ChunkedCommitter:
+    def __init__(self, conn, label, every_rows=COMMIT_EVERY_ROWS, every_seconds=COMMIT_EVERY_SECONDS):
+        self.conn = conn
+        self.label = label
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.pending = 0
+        self.committed = 0
+        self.chunks = 0
+        self.chunk_start = time.monotonic()
+
+    def tick(self, rows=1):
+        self.pending += rows
+        if self.every_rows and self.pending >= self.every_rows:
+            self.commit()
+        elif self.every_seconds and time.monotonic() - self.chunk_start >= self.every_seconds:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        commit_start = time.monotonic()
+        self.conn.commit()
+        now = time.monotonic()
+        elapsed = now - self.chunk_start
+        self.chunks += 1
+        self.committed += self.pending
+        logger.info(
+            f"[COMMIT] {self.label} chunk {self.chunks}: {self.pending} rows in {elapsed:.2f}s "
+            f"({self.pending / elapsed if elapsed else 0:.0f} rows/s, commit {now - commit_start:.2f}s)"
+        )
+        self.pending = 0
+        self.chunk_start = now
+
+    def finish(self):
+        self.commit()
+        logger.info(f"[COMMIT] {self.label}: {self.committed} rows committed in {self.chunks} chunks")
+
 def reconcile():
     updated = 0
     unmatched = []
+    matched_keys = []
+
+    s3_index = build_s3_index()
+    committer = ChunkedCommitter(conn, "reconcile", args.commit_rows, args.commit_seconds)
 
     with conn.cursor() as cursor:
         cursor.execute(f"SELECT id, url FROM {TABLE_NAME}")
@@ -108,22 +180,25 @@ def reconcile():
                 continue
 
             s3_key = f"{PREFIX}{file_name}"
-            etag = s3_object_exists(s3_key)
+            entry = s3_index.get(s3_key)
+            etag = entry[0] if entry else None
 
             if etag:
                 logger.info(f"[MATCHED] {file_name} → {s3_key}")
+                matched_keys.append(s3_key)
                 if not args.dry_run:
                     cursor.execute(
                         f"UPDATE {TABLE_NAME} SET hcp_id = %s, path = %s WHERE id = %s",
                         (etag, s3_key, row["id"])
                     )
                     updated += 1
+                    committer.tick()
             else:
                 unmatched.append({"id": row["id"], "url": url, "expected_key": s3_key})
                 logger.warning(f"[MISSING] {file_name} not found in S3")
 
         if not args.dry_run:
-            conn.commit()
+            committer.finish()
 
     if unmatched:
         with open(UNMATCHED_OUTPUT, "w", newline='', encoding="utf-8") as csvfile:
@@ -134,6 +209,9 @@ def reconcile():
                 writer.writerow(row)
         logger.info(f"Exported {len(unmatched)} unmatched rows to {UNMATCHED_OUTPUT}")
 
+    if args.verify_head and matched_keys:
+        verify_index_sample(s3_index, matched_keys, args.verify_head)
+
     logger.info(f"Updated {updated} rows in DB (dry run: {args.dry_run})")
 
 if __name__ == "__main__":
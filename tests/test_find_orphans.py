@@ -0,0 +1,111 @@
+import ast
+import hashlib
+import logging
+import math
+import unicodedata
+from pathlib import Path
+from urllib.parse import unquote
+
+import pytest
+
+SOURCE = Path(__file__).resolve().parent.parent / "fuzzy.py"
+NAMES = (
+    "normalize_filename", "orphan_match_key", "BloomFilter",
+    "db_paths_present", "resolve_suspects", "find_orphans_bloom",
+)
+
+
+# fuzzy.py holds several scripts that connect on import, so only the find-orphans
+# definitions of the unified tool are compiled, against fakes for the DB and listing
+def load_script(**fakes):
+    namespace = {
+        "unicodedata": unicodedata, "unquote": unquote, "hashlib": hashlib, "math": math,
+        "logger": logging.getLogger(__name__), "TABLE_NAME": "files", "TARGET_PREFIX": "new-adam/",
+        "BLOOM_ERROR_RATE": 0.01, "BLOOM_CONFIRM_BATCH": 2, **fakes,
+    }
+    scripts = SOURCE.read_text(encoding="utf-8").split("#!/usr/bin/env python3")
+    tree = ast.parse(next(script for script in scripts if "def find_orphans_bloom" in script))
+    nodes = [node for node in tree.body if getattr(node, "name", None) in NAMES]
+    assert {node.name for node in nodes} == set(NAMES)
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), str(SOURCE), "exec"), namespace)
+    return namespace
+
+
+class FakeCursor:
+    def __init__(self, paths, norm):
+        self.paths = paths
+        self.norm = norm
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if "COUNT(*)" in sql:
+            self.rows = [{"paths": len(self.paths)}]
+        elif "path_norm IN" in sql:
+            self.rows = [{"path_norm": self.norm(path)} for path in self.paths if self.norm(path) in params]
+        else:
+            # a binary-collation path index only finds byte-identical spellings
+            self.rows = [{"path": path} for path in self.paths if path in params]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDb:
+    def __init__(self, paths, norm):
+        self.paths = paths
+        self.norm = norm
+
+    def cursor(self):
+        return FakeCursor(self.paths, self.norm)
+
+
+class FakeOrphanWriter:
+    def __init__(self, found):
+        self.found = found
+
+    def add(self, key, etag, size):
+        self.found.append(key)
+
+    def close(self):
+        pass
+
+
+class Args:
+    bloom_error_rate = 0.01
+    fetch_size = 100
+    trust_manifest = True
+
+
+def run_bloom(db_paths, s3_keys, use_norm):
+    found = []
+    namespace = load_script(
+        norm_columns_usable=lambda: use_norm,
+        stream_rows=lambda sql, params=None, fetch_size=None: ({"path": path} for path in db_paths),
+        iter_s3_objects=lambda prefix, refresh=False: ((key, "etag", 1) for key in s3_keys),
+        OrphanWriter=lambda: FakeOrphanWriter(found),
+    )
+    namespace["db"] = FakeDb(db_paths, namespace["orphan_match_key"])
+    namespace["find_orphans_bloom"](Args())
+    return found
+
+
+@pytest.mark.parametrize("use_norm", [False, True])
+def test_encoded_or_padded_db_path_is_not_an_orphan(use_norm):
+    db_paths = ["New-Adam/My%20File.pdf ", "new-adam/plain.pdf"]
+    s3_keys = ["new-adam/My File.pdf", "new-adam/plain.pdf", "new-adam/untracked.pdf"]
+    assert run_bloom(db_paths, s3_keys, use_norm) == ["new-adam/untracked.pdf"]
+
+
+def test_resolve_suspects_matches_on_the_normalized_key():
+    resolve = load_script()["resolve_suspects"]
+    present = resolve(["new-adam/My File.pdf", "new-adam/gone.pdf"], ["  NEW-ADAM/my%20file.pdf"])
+    assert present == {"new-adam/my file.pdf"}